@@ -1,211 +1,682 @@
+import concurrent.futures
+import os
+import random
+import threading
+import time
+import warnings
+from . import book, engine, tablebase
+
 CHECKMATE = 100000
+# A tablebase win, below any mate the search finds itself
+TABLEBASE_WIN = CHECKMATE // 2
 STALEMATE = 0
 DEPTH = 3
 
+# Transposition table bound types
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+TABLE_SIZE_MB = 32
+
+# Material values, the same base values engine.piece_scores is built from
+PIECE_VALUES = {"K": 900, "Q": 90, "R": 50, "B": 30, "N": 30, "P": 10, "_": 0}
+# Extra gain a capture is allowed for positional swings before delta pruning
+# gives up on it
+DELTA_MARGIN = 20
+
+# Move ordering: hash move, then captures by MVV-LVA, then killer moves, then
+# quiet moves by history score. Below the root staged_moves gives the same
+# order, with captures that lose material moved to the end
+HASH_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000
+KILLER_SCORES = (90000, 80000)
+MAX_PLY = 64
+
+# piece_scores are in half points, so no score falls strictly inside a window
+# this narrow
+NULL_WINDOW = 0.5
+# Each depth first searches this far either side of the score of the depth
+# before it. The side that fails is widened once by twice this, a second
+# failure on a side (or a score already beyond a tablebase win, i.e. a mate
+# coming up) opens that side all the way
+ASPIRATION_WINDOW = 5
+
+# How often the GUI's search process looks whether its search was cancelled
+CANCEL_POLL_SECONDS = 0.05
+
+# Processes used by find_best_move_parallel when no worker count is given
+WORKERS = os.cpu_count() or 1
+
+# A Polyglot opening book placed here is used by find_best_move
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")
+# And Syzygy tablebase files placed here, when python-chess is installed
+TABLEBASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "syzygy")
+
+
+class TranspositionTable():
+    # Approximate size of one entry: its list slot, the entry tuple and the
+    # key, score and move id objects it holds
+    ENTRY_SIZE = 200
+
+    def __init__(self, size_mb=TABLE_SIZE_MB):
+        # Each bucket has a depth-preferred slot followed by an always-replace slot
+        self.bucket_count = max(1, size_mb * 1024 * 1024 // (2 * self.ENTRY_SIZE))
+        self.entries = [None] * (2 * self.bucket_count)
+        self.generation = 0
+
+    # Called once per search so entries left over from earlier moves lose
+    # their claim on the depth-preferred slots
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * (2 * self.bucket_count)
+        self.generation = 0
+
+    # Entries are (key, depth, score, bound, best move id, generation)
+    def probe(self, key):
+        index = 2 * (key % self.bucket_count)
+        entry = self.entries[index]
+        if entry is not None and entry[0] == key:
+            return entry
+        entry = self.entries[index + 1]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, best_move_id):
+        index = 2 * (key % self.bucket_count)
+        entry = (key, depth, score, bound, best_move_id, self.generation)
+        old_entry = self.entries[index]
+        if old_entry is None or old_entry[0] == key or depth >= old_entry[1] or \
+                old_entry[5] != self.generation:
+            self.entries[index] = entry
+        else:
+            self.entries[index + 1] = entry
+
+
+# Raised from inside negamax once the time or node budget runs out
+class SearchTimeout(Exception):
+    pass
+
+
+# Everything one search needs: its limits, its tables, statistics about the
+# last search and its result. A game keeps one Searcher for all its moves so
+# the tables carry over, separate games use separate Searchers
+class Searcher():
+    def __init__(self, max_depth=DEPTH, time_limit_ms=None, node_limit=None,
+                 table_size_mb=TABLE_SIZE_MB):
+        self.max_depth = max_depth
+        self.time_limit_ms = time_limit_ms
+        self.node_limit = node_limit
+        self.transposition_table = TranspositionTable(table_size_mb)
+        # Two quiet moves per ply that recently caused a beta cutoff
+        self.killer_moves = [[None, None] for ply in range(MAX_PLY)]
+        # How often a quiet move of a piece to a square caused a cutoff,
+        # weighted by depth
+        self.history = {piece: [[0] * 8 for row in range(8)]
+                        for piece in engine.piece_scores if piece != "__"}
+
+        # Statistics and result of the last search
+        self.nodes = 0
+        self.depth_reached = 0
+        self.elapsed = 0
+        self.best_move = None
+        self.best_score = None
+
+        # A book.OpeningBook to take moves from before searching
+        self.book = None
+        # A tablebase.Tablebase to look endgames up in
+        self.tablebase = None
+        # Called with the Searcher after every completed depth
+        self.on_depth = None
+        # Set from another thread to end a running search, it then returns the
+        # move from the last completed depth
+        self.stop_requested = False
+
+        # Used while searching
+        self.root_depth = 0
+        self.root_best_move = None
+        self.deadline = None
+
+    # For a new game, nothing learned in the old one applies
+    def clear(self):
+        self.transposition_table.clear()
+        for killers in self.killer_moves:
+            killers[0] = killers[1] = None
+        for piece_history in self.history.values():
+            for row in piece_history:
+                for column in range(8):
+                    row[column] = 0
 
-# score of piece = piece personal score - positional score on board
-piece_scores = {
-    "wK": [
-        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
-        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
-        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
-        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
-        [900 - 2, 900 - 3, 900 - 3, 900 - 4, 900 - 4, 900 - 3, 900 - 3, 900 - 2],
-        [900 - 1, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 1],
-        [900 + 2, 900 + 2, 900 + 0, 900 + 0, 900 + 0, 900 + 0, 900 + 2, 900 + 2],
-        [900 + 2, 900 + 3, 900 + 1, 900 + 0, 900 + 0, 900 + 1, 900 + 3, 900 + 2]
-    ],
-    "bK": [
-        [900 + 2, 900 + 3, 900 + 1, 900 + 0, 900 + 0, 900 + 1, 900 + 3, 900 + 2],
-        [900 + 2, 900 + 2, 900 + 0, 900 + 0, 900 + 0, 900 + 0, 900 + 2, 900 + 2],
-        [900 - 1, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 1],
-        [900 - 2, 900 - 3, 900 - 3, 900 - 4, 900 - 4, 900 - 3, 900 - 3, 900 - 2],
-        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
-        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
-        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
-        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3]
-    ],
-    "wQ": [
-        [90 - 2, 90 - 1, 90 - 1, 90 - .5, 90 - .5, 90 - 1, 90 - 1, 90 - 2],
-        [90 - 1, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 1],
-        [90 - 1, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - 1],
-        [90 - .5, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - .5],
-        [90 - 0, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - .5],
-        [90 - 1, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - 1],
-        [90 - 1, 90 - 0, 90 + .5, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 1],
-        [90 - 2, 90 - 1, 90 - 1, 90 - .5, 90 - .5, 90 - 1, 90 - 1, 90 - 2]
-    ],
-    "bQ": [
-        [90 - 2, 90 - 1, 90 - 1, 90 - .5, 90 - .5, 90 - 1, 90 - 1, 90 - 2],
-        [90 - 1, 90 - 0, 90 + 0, 90 - 0, 90 - 0, 90 + .5, 90 - 0, 90 - 1],
-        [90 - 1, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 1],
-        [90 - .5, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - 0],
-        [90 - .5, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - .5],
-        [90 - 1, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - 1],
-        [90 - 1, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 1],
-        [90 - 2, 90 - 1, 90 - 1, 90 - .5, 90 - .5, 90 - 1, 90 - 1, 90 - 2]
-    ],
-    "wR": [
-        [50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0],
-        [50 + .5, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + .5],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 + 0, 50 + 0, 50 + 0, 50 + .5, 50 + .5, 50 + 0, 50 + 0, 50 + 0]
-    ],
-    "bR": [
-        [50 + 0, 50 + 0, 50 + 0, 50 + .5, 50 + .5, 50 + 0, 50 + 0, 50 + 0],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
-        [50 + .5, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + .5],
-        [50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0]
-    ],
-    "wB": [
-        [30 - 2, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 2],
-        [30 - 1, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 1],
-        [30 - 1, 30 - 0, 30 + .5, 30 + 1, 30 + 1, 30 + .5, 30 - 0, 30 - 1],
-        [30 - 1, 30 + .5, 30 + .5, 30 + 1, 30 + 1, 30 + .5, 30 + .5, 30 - 1],
-        [30 - 1, 30 - 0, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 - 0, 30 - 1],
-        [30 - 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 - 1],
-        [30 - 1, 30 + .5, 30 + 0, 30 + 0, 30 + 0, 30 + 0, 30 + .5, 30 - 1],
-        [30 - 2, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 2]
-    ],
-    "bB": [
-        [30 - 2, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 2],
-        [30 - 1, 30 + .5, 30 + 0, 30 + 0, 30 + 0, 30 + 0, 30 + .5, 30 - 1],
-        [30 + 2, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 2],
-        [30 - 1, 30 - 0, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 - 0, 30 - 1],
-        [30 - 1, 30 + .5, 30 + .5, 30 + 1, 30 + 1, 30 + .5, 30 + .5, 30 - 1],
-        [30 - 1, 30 - 0, 30 + .5, 30 + 1, 30 + 1, 30 + .5, 30 - 0, 30 - 1],
-        [30 - 1, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 1],
-        [30 - 2, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 2]
-    ],
-    "wN": [
-        [30 - 5, 30 - 4, 30 - 3, 30 - 3, 30 - 3, 30 - 3, 30 - 4, 30 - 5],
-        [30 - 4, 30 - 2, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 2, 30 - 4],
-        [30 - 3, 30 - 0, 30 + 1, 30 + 1.5, 30 + 1.5, 30 + 1, 30 + 0, 30 - 3],
-        [30 - 3, 30 + .5, 30 + 1.5, 30 + 2, 30 + 2, 30 + 1.5, 30 + .5, 30 - 3],
-        [30 - 3, 30 + 0, 30 + 1.5, 30 + 2, 30 + 2, 30 + 1.5, 30 + 0, 30 - 3],
-        [30 - 3, 30 + .5, 30 + 1, 30 + 1.5, 30 + 1.5, 30 + 1, 30 + .5, 30 - 3],
-        [30 - 4, 30 - 2, 30 - 0, 30 + .5, 30 + .5, 30 + 0, 30 - 2, 30 - 4],
-        [30 - 5, 30 - 4, 30 - 3, 30 - 3, 30 - 3, 30 - 3, 30 - 4, 30 - 5]
-    ],
-    "bN": [
-        [30 - 5, 30 - 4, 30 - 3, 30 - 3, 30 - 3, 30 - 3, 30 - 4, 30 - 5],
-        [30 - 4, 30 - 2, 30 - 0, 30 + .5, 30 + .5, 30 + 0, 30 - 2, 30 - 4],
-        [30 - 3, 30 + .5, 30 + 1, 30 + 1.5, 30 + 1.5, 30 + 1, 30 + .5, 30 - 3],
-        [30 - 3, 30 + 0, 30 + 1.5, 30 + 2, 30 + 2, 30 + 1.5, 30 + 0, 30 - 3],
-        [30 - 3, 30 + .5, 30 + 1.5, 30 + 2, 30 + 2, 30 + 1.5, 30 + .5, 30 - 3],
-        [30 - 3, 30 - 0, 30 + 1, 30 + 1.5, 30 + 1.5, 30 + 1, 30 + 0, 30 - 3],
-        [30 - 4, 30 - 2, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 2, 30 - 4],
-        [30 - 5, 30 - 4, 30 - 3, 30 - 3, 30 - 3, 30 - 3, 30 - 4, 30 - 5]
-    ],
-    "wP": [
-        [10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0],
-        [10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5],
-        [10 + 1, 10 + 1, 10 + 2, 10 + 3, 10 + 3, 10 + 2, 10 + 1, 10 + 1],
-        [10 + .5, 10 + .5, 10 + 1, 10 + 2.5, 10 + 2.5, 10 + 1, 10 + .5, 10 + .5],
-        [10 - 0, 10 - 0, 10 - 0, 10 + 2, 10 + 2, 10 - 0, 10 - 0, 10 - 0],
-        [10 + .5, 10 - .5, 10 - 1, 10 - 0, 10 - 0, 10 - 1, 10 - .5, 10 + .5],
-        [10 - 1, 10 + .5, 10 - 0, 10 - 0, 10 - 0, 10 - 0, 10 + .5, 10 - 1],
-        [10 - 2, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 2]
-    ],
-    "bP": [
-        [10 - 2, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 2],
-        [10 - 1, 10 + .5, 10 - 0, 10 - 0, 10 - 0, 10 - 0, 10 + .5, 10 - 1],
-        [10 + .5, 10 + 2, 10 - 1, 10 - 0, 10 - 0, 10 - 1, 10 + 2, 10 + .5],
-        [10 - 0, 10 - 0, 10 - 0, 10 + 2, 10 + 2, 10 - 0, 10 - 0, 10 - 0],
-        [10 + .5, 10 + .5, 10 + 1, 10 + 2.5, 10 + 2.5, 10 + 1, 10 + .5, 10 + .5],
-        [10 + 1, 10 + 1, 10 + 2, 10 + 3, 10 + 3, 10 + 2, 10 + 1, 10 + 1],
-        [10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5],
-        [10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0]
-    ],
-    "__": [
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 0]
-    ]
-}
-
-
-def find_best_move(game_state, valid_moves):
-    global best_move
-    best_move = None
-    mini_max(game_state, valid_moves, DEPTH, -CHECKMATE, CHECKMATE,
-             True)
-    return best_move
-
-
-def mini_max(game_state, valid_moves, depth, alpha, beta, is_AI_move):
-    global best_move
-
-    if depth == 0:
-        return board_score(game_state)
-
-    if is_AI_move:
-        min_score = float('inf')
-        valid_moves.sort(
-            key=lambda x: piece_scores[x.piece_captured][x.end_row][x.end_column])
-        valid_moves.reverse()
-        for move in valid_moves:
+    # Searching depth 1, 2, 3... up to max_depth. With a time budget
+    # (milliseconds) or node limit the search stops early and the move from
+    # the last completed depth is returned. Depth 1 always completes so there
+    # is always a move
+    def search(self, game_state, valid_moves):
+        self.transposition_table.new_search()
+        self.age_move_ordering()
+        start_time = time.perf_counter()
+        time_limit_ms = self.time_limit_ms
+        self.deadline = start_time + time_limit_ms / 1000 if time_limit_ms else None
+        self.nodes = 0
+        self.depth_reached = 0
+        self.best_move = None
+        self.best_score = None
+        start_log_length = len(game_state.move_log)
+
+        if self.book is not None:
+            self.best_move = self.book.choose_move(game_state, valid_moves)
+            if self.best_move is not None:
+                self.elapsed = time.perf_counter() - start_time
+                self.stop_requested = False
+                return self.best_move
+
+        if self.tablebase is not None and self.tablebase.covers(game_state):
+            move, wdl = self.tablebase.probe_root(game_state, valid_moves)
+            if move is not None:
+                self.best_move = move
+                self.best_score = tablebase_score(wdl, game_state.is_white_move)
+                self.elapsed = time.perf_counter() - start_time
+                self.stop_requested = False
+                return self.best_move
+
+        # The search scores from the side to move's point of view, results
+        # are kept from white's
+        color = 1 if game_state.is_white_move else -1
+        for depth in range(1, self.max_depth + 1):
+            self.root_depth = depth
+            if self.best_score is not None and abs(self.best_score) < TABLEBASE_WIN:
+                alpha = color * self.best_score - ASPIRATION_WINDOW
+                beta = color * self.best_score + ASPIRATION_WINDOW
+            else:
+                alpha, beta = -CHECKMATE, CHECKMATE
+            low_failures = high_failures = 0
+            try:
+                while True:
+                    self.root_best_move = None
+                    score = self.negamax(game_state, valid_moves, depth, alpha, beta)
+                    if score <= alpha and alpha > -CHECKMATE:
+                        low_failures += 1
+                        if low_failures > 1 or score <= -TABLEBASE_WIN:
+                            alpha = -CHECKMATE
+                        else:
+                            alpha = max(-CHECKMATE, alpha - 2 * ASPIRATION_WINDOW)
+                    elif score >= beta and beta < CHECKMATE:
+                        high_failures += 1
+                        if high_failures > 1 or score >= TABLEBASE_WIN:
+                            beta = CHECKMATE
+                        else:
+                            beta = min(CHECKMATE, beta + 2 * ASPIRATION_WINDOW)
+                    else:
+                        break
+                score *= color
+            except SearchTimeout:
+                # The search was abandoned mid-tree, take back its moves
+                while len(game_state.move_log) > start_log_length:
+                    game_state.undo_move()
+                break
+            self.best_move = self.root_best_move
+            self.best_score = score
+            self.depth_reached = depth
+            self.elapsed = time.perf_counter() - start_time
+            if self.on_depth:
+                self.on_depth(self)
+            # Mate scores do not count the moves to mate, so searching deeper
+            # cannot find a better one
+            if abs(score) >= CHECKMATE:
+                break
+            # The next depth takes several times longer, so it would not finish
+            if self.deadline and time.perf_counter() - start_time > \
+                    (self.deadline - start_time) / 2:
+                break
+        self.elapsed = time.perf_counter() - start_time
+        self.stop_requested = False
+        return self.best_move
+
+    def stop(self):
+        self.stop_requested = True
+
+    def check_limits(self):
+        self.nodes += 1
+        if self.root_depth > 1:
+            if self.node_limit and self.nodes >= self.node_limit:
+                raise SearchTimeout
+            if self.nodes % 256 == 0 and (self.stop_requested or (
+                    self.deadline and time.perf_counter() > self.deadline)):
+                raise SearchTimeout
+
+    # The best move followed by the moves stored for the positions after it in
+    # the transposition table, as far as they are legal and the last search
+    # went
+    def principal_variation(self, game_state):
+        line = []
+        move = self.best_move
+        while move is not None and len(line) < self.depth_reached:
+            line.append(move)
             game_state.make_move(move)
-            next_moves = game_state.get_valid_moves()
-            score = mini_max(game_state, next_moves,
-                             depth - 1, alpha, beta, False)
-            if score < min_score:
-                min_score = score
-                best_move = move if DEPTH == depth else best_move
+            entry = self.transposition_table.probe(game_state.zobrist_key)
+            move = None
+            if entry is not None and entry[4] is not None:
+                for valid_move in game_state.get_valid_moves():
+                    if valid_move.move_id == entry[4]:
+                        move = valid_move
+                        break
+        for move in line:
             game_state.undo_move()
-            beta = min(beta, score)
-            if beta <= alpha:
+        return line
+
+    # Killers only make sense within one search, history is halved so it
+    # keeps some of what was learned on earlier moves of the game
+    def age_move_ordering(self):
+        for killers in self.killer_moves:
+            killers[0] = killers[1] = None
+        for piece_history in self.history.values():
+            for row in piece_history:
+                for column in range(8):
+                    row[column] //= 2
+
+    def score_moves(self, moves, hash_move_id, ply):
+        killers = self.killer_moves[ply] if ply < MAX_PLY else (None, None)
+        history = self.history
+        scores = []
+        for move in moves:
+            move_id = move.move_id
+            if move_id == hash_move_id:
+                scores.append(HASH_MOVE_SCORE)
+            elif move.piece_captured != "__" or move.is_pawn_promotion:
+                scores.append(CAPTURE_SCORE + mvv_lva(move))
+            elif move_id == killers[0]:
+                scores.append(KILLER_SCORES[0])
+            elif move_id == killers[1]:
+                scores.append(KILLER_SCORES[1])
+            else:
+                scores.append(history[move.piece_moved][move.end_row][move.end_column])
+        return scores
+
+    # Yields the moves of a position one stage at a time: the hash move,
+    # captures that do not lose material, killer moves, quiet moves by history
+    # and then the losing captures. A stage is only generated once the ones
+    # before it gave no cutoff, which at most cut nodes is before any quiet
+    # move exists
+    def staged_moves(self, game_state, hash_move_id, ply):
+        searched = set()
+        if hash_move_id is not None:
+            move = find_move(game_state, hash_move_id)
+            if move is not None:
+                searched.add(hash_move_id)
+                yield move
+
+        winning_captures, losing_captures = [], []
+        for move in game_state.get_capture_moves():
+            if move.move_id in searched:
+                continue
+            searched.add(move.move_id)
+            if is_losing_capture(game_state, move):
+                losing_captures.append(move)
+            else:
+                winning_captures.append(move)
+        yield from pick_moves(winning_captures,
+                              [mvv_lva(move) for move in winning_captures])
+
+        # Copied, searching the first killer can replace the second one
+        killers = list(self.killer_moves[ply]) if ply < MAX_PLY else []
+        for killer_id in killers:
+            if killer_id is not None and killer_id not in searched:
+                move = find_move(game_state, killer_id)
+                if move is not None:
+                    searched.add(killer_id)
+                    yield move
+
+        # Also sets check_mate and stale_mate when there are no moves at all
+        quiet_moves = [move for move in game_state.get_valid_moves()
+                       if move.move_id not in searched]
+        history = self.history
+        yield from pick_moves(quiet_moves,
+                              [history[move.piece_moved][move.end_row][move.end_column]
+                               for move in quiet_moves])
+        yield from pick_moves(losing_captures,
+                              [mvv_lva(move) for move in losing_captures])
+
+    def record_cutoff(self, move, depth, ply):
+        if move.piece_captured != "__" or move.is_pawn_promotion:
+            return
+        self.history[move.piece_moved][move.end_row][move.end_column] += depth * depth
+        if ply < MAX_PLY:
+            killers = self.killer_moves[ply]
+            if killers[0] != move.move_id:
+                killers[1] = killers[0]
+                killers[0] = move.move_id
+
+    # Negamax, so scores are from the side to move's point of view. Principal
+    # variation search: the first move is searched with the full window and
+    # the rest with a null window, which only proves them no better. A move
+    # that turns out better after all is searched again with the full window.
+    # valid_moves is only given at the root, below it the moves come from
+    # staged_moves as they are needed
+    def negamax(self, game_state, valid_moves, depth, alpha, beta):
+        self.check_limits()
+        color = 1 if game_state.is_white_move else -1
+
+        # The piece count only drops on captures, so the tables are only
+        # looked at after a capture or pawn move
+        if self.tablebase is not None and game_state.halfmove_clock == 0 and \
+                depth != self.root_depth and self.tablebase.covers(game_state):
+            wdl = self.tablebase.probe_wdl(game_state)
+            if wdl is not None:
+                return color * tablebase_score(wdl, game_state.is_white_move)
+
+        if depth == 0:
+            return self.quiescence(game_state, alpha, beta)
+
+        original_alpha = alpha
+        key = game_state.zobrist_key
+        entry = self.transposition_table.probe(key)
+        is_root = depth == self.root_depth
+        # The root never returns early, it has to set root_best_move
+        if entry is not None and entry[1] >= depth and not is_root:
+            if entry[3] == EXACT:
+                return entry[2]
+            elif entry[3] == LOWER_BOUND:
+                alpha = max(alpha, entry[2])
+            else:
+                beta = min(beta, entry[2])
+            if alpha >= beta:
+                return entry[2]
+        node_best_move = None
+
+        ply = self.root_depth - depth
+        if is_root:
+            hash_move_id = self.best_move.move_id if self.best_move is not None else None
+            ordered_moves = pick_moves(valid_moves,
+                                       self.score_moves(valid_moves, hash_move_id, ply))
+        else:
+            hash_move_id = entry[4] if entry is not None else None
+            ordered_moves = self.staged_moves(game_state, hash_move_id, ply)
+
+        best_score = -float('inf')
+        for move in ordered_moves:
+            game_state.make_move(move)
+            if node_best_move is None:
+                score = -self.negamax(game_state, None, depth - 1, -beta, -alpha)
+            else:
+                score = -self.negamax(game_state, None, depth - 1,
+                                      -alpha - NULL_WINDOW, -alpha)
+                if alpha < score < beta:
+                    score = -self.negamax(game_state, None, depth - 1, -beta, -alpha)
+            game_state.undo_move()
+            if score > best_score:
+                best_score = score
+                node_best_move = move
+                if is_root:
+                    self.root_best_move = move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                self.record_cutoff(move, depth, ply)
                 break
-        return min_score
-    else:
-        max_score = -float('inf')
-        valid_moves.sort(key=lambda x: piece_scores[x.piece_captured])
-        valid_moves.reverse()
-        for move in valid_moves:
+
+        # Checkmate or stalemate, the flags were set by staged_moves
+        if node_best_move is None:
+            return color * board_score(game_state)
+        self.store_score(key, depth, best_score, original_alpha, beta, node_best_move)
+        return best_score
+
+    # Searching captures only until the position is quiet, so the evaluation
+    # is never taken in the middle of an exchange. Standing pat is not allowed
+    # while in check, there every evasion is searched instead, nor in a
+    # stalemate, which a position without captures is checked for
+    def quiescence(self, game_state, alpha, beta):
+        self.check_limits()
+        color = 1 if game_state.is_white_move else -1
+
+        in_check = game_state.in_check()
+        if in_check:
+            moves = game_state.get_valid_moves()
+            if not moves:
+                return color * board_score(game_state)
+            best_score = -float('inf')
+        else:
+            moves = game_state.get_capture_moves()
+            # Also sets stale_mate when there are no moves at all
+            if not moves and not game_state.get_valid_moves():
+                return color * board_score(game_state)
+            stand_pat = color * board_score(game_state)
+            if stand_pat >= beta:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+            best_score = stand_pat
+
+        for move in pick_moves(moves, [mvv_lva(move) for move in moves]):
+            # Delta pruning, even winning the piece cannot get above alpha.
+            # The move is only known to score below that optimistic bound, so
+            # the bound and not stand_pat is what a fail-low has to return
+            if not in_check:
+                optimistic_score = stand_pat + capture_gain(move) + DELTA_MARGIN
+                if optimistic_score <= alpha:
+                    best_score = max(best_score, optimistic_score)
+                    continue
             game_state.make_move(move)
-            next_moves = game_state.get_valid_moves()
-            score = mini_max(game_state, next_moves,
-                             depth - 1, alpha, beta, True)
-            if score > max_score:
-                max_score = score
-                best_move = move if DEPTH == depth else best_move
+            score = -self.quiescence(game_state, -beta, -alpha)
             game_state.undo_move()
+            best_score = max(best_score, score)
             alpha = max(alpha, score)
-            if beta <= alpha:
+            if alpha >= beta:
                 break
-        return max_score
+        return best_score
+
+    def store_score(self, key, depth, score, alpha, beta, move):
+        if score <= alpha:
+            bound = UPPER_BOUND
+        elif score >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.transposition_table.store(key, depth, score, bound,
+                                       move.move_id if move else None)
+
+
+# Used by find_best_move, so its tables carry over from one move to the next
+# in a game
+default_searcher = Searcher()
+if os.path.exists(BOOK_PATH):
+    default_searcher.book = book.OpeningBook(BOOK_PATH)
+if os.path.isdir(TABLEBASE_PATH):
+    try:
+        default_searcher.tablebase = tablebase.Tablebase(TABLEBASE_PATH)
+    except ImportError as error:
+        warnings.warn("{}, {} is not used".format(error, TABLEBASE_PATH))
+
+# Created by the first parallel search and reused by the ones after it
+process_pool = None
+pool_workers = 0
+
+
+def find_best_move(game_state, valid_moves, max_depth=DEPTH, time_limit_ms=None,
+                   node_limit=None):
+    default_searcher.max_depth = max_depth
+    default_searcher.time_limit_ms = time_limit_ms
+    default_searcher.node_limit = node_limit
+    return default_searcher.search(game_state, valid_moves)
+
+
+# The GUI's search process, running for the whole session so that
+# default_searcher's tables carry over from one move to the next. Requests are
+# ("search", search_id, game_state), ("new_game",) and ("quit",), searches are
+# answered with (search_id, move_id). The GUI cancels a search by changing
+# current_search_id, the search is then stopped and its answer is ignored
+def search_worker(request_queue, return_queue, current_search_id):
+    lock = threading.Lock()
+    active_search_id = None
+
+    def watch_for_cancel():
+        while True:
+            time.sleep(CANCEL_POLL_SECONDS)
+            with lock:
+                if active_search_id is not None and \
+                        current_search_id.value != active_search_id:
+                    default_searcher.stop()
+
+    threading.Thread(target=watch_for_cancel, daemon=True).start()
+    while True:
+        request = request_queue.get()
+        if request[0] == "quit":
+            break
+        if request[0] == "new_game":
+            default_searcher.clear()
+            continue
+        search_id, game_state = request[1], request[2]
+        with lock:
+            # Cancelled before it was even started
+            if current_search_id.value != search_id:
+                continue
+            active_search_id = search_id
+            default_searcher.stop_requested = False
+        valid_moves = game_state.get_valid_moves()
+        move = find_best_move(game_state, valid_moves)
+        if not move:
+            move = random_move(valid_moves)
+        with lock:
+            active_search_id = None
+            default_searcher.stop_requested = False
+        return_queue.put((search_id, move.move_id))
+
+
+def random_move(valid_moves):
+    return random.choice(valid_moves)
+
+
+# Splitting the root moves between worker processes, each searching its share
+# with its own Searcher, and keeping the result best for the side to move.
+# Workers get the position as a FEN, so the game history (and any state beyond
+# the FEN) is not seen by them. The node limit is shared out between the workers
+def find_best_move_parallel(game_state, valid_moves, workers=WORKERS,
+                            max_depth=DEPTH, time_limit_ms=None,
+                            node_limit=None):
+    global process_pool, pool_workers
+    if default_searcher.book is not None:
+        book_move = default_searcher.book.choose_move(game_state, valid_moves)
+        if book_move is not None:
+            return book_move
+    workers = min(workers, len(valid_moves))
+    if workers <= 1:
+        return find_best_move(game_state, valid_moves, max_depth,
+                              time_limit_ms, node_limit)
+    if process_pool is None or pool_workers < workers:
+        if process_pool is not None:
+            process_pool.shutdown()
+        process_pool = concurrent.futures.ProcessPoolExecutor(workers)
+        pool_workers = workers
+
+    # Dealing the moves out in move ordering order spreads the captures and
+    # other likely best moves over all the workers
+    root_moves = list(pick_moves(list(valid_moves),
+                                 default_searcher.score_moves(valid_moves, None, 0)))
+    fen = game_state.get_fen()
+    worker_node_limit = node_limit // workers if node_limit else None
+    futures = []
+    for worker in range(workers):
+        move_ids = [move.move_id for move in root_moves[worker::workers]]
+        futures.append(process_pool.submit(
+            search_root_moves, type(game_state), fen, move_ids, max_depth,
+            time_limit_ms, worker_node_limit))
+
+    # Ties go to the move earliest in root_moves, so the pick does not depend
+    # on which worker finished first
+    moves_by_id = {move.move_id: move for move in root_moves}
+    order = {move.move_id: i for i, move in enumerate(root_moves)}
+    sign = 1 if game_state.is_white_move else -1
+    results = [future.result() for future in futures]
+    score, move_id = min(results,
+                         key=lambda result: (-sign * result[0], order[result[1]]))
+    return moves_by_id[move_id]
+
+
+# Runs in a worker process. A fresh Searcher is used for every task, since the
+# pool may hand any task to any worker and leftover table entries or history
+# would make the result depend on which one it was
+def search_root_moves(game_state_class, fen, move_ids, max_depth,
+                      time_limit_ms, node_limit):
+    game_state = game_state_class.from_fen(fen)
+    moves = [move for move in game_state.get_valid_moves()
+             if move.move_id in move_ids]
+    searcher = Searcher(max_depth, time_limit_ms, node_limit)
+    move = searcher.search(game_state, moves)
+    return searcher.best_score, move.move_id
+
+
+# Most valuable victim (counting what a pawn promotes to) first, least
+# valuable attacker breaking ties
+def mvv_lva(move):
+    return capture_gain(move) * 100 - PIECE_VALUES[move.piece_moved[1]]
+
+
+# A capture of a cheaper piece on a square the opponent defends, going by
+# the attack tables rather than playing out the exchange
+def is_losing_capture(game_state, move):
+    if capture_gain(move) >= PIECE_VALUES[move.piece_moved[1]]:
+        return False
+    enemy_color = "b" if game_state.is_white_move else "w"
+    return game_state.is_square_attacked(move.end_row, move.end_column, enemy_color)
+
+
+# The legal move with this id in the position, or None. Only the moves of the
+# piece on its start square are generated
+def find_move(game_state, move_id):
+    for move in game_state.get_piece_moves((move_id >> 3) & 7, move_id & 7):
+        if move.move_id == move_id:
+            return move
+    return None
+
+
+def capture_gain(move):
+    gain = PIECE_VALUES[move.piece_captured[1]]
+    if move.is_pawn_promotion:
+        gain += PIECE_VALUES[move.promotion_piece] - PIECE_VALUES["P"]
+    return gain
+
+
+# Selection sort done one step at a time, so after an early cutoff the
+# rest of the moves are never sorted
+def pick_moves(moves, scores):
+    for i in range(len(moves)):
+        best = i
+        for j in range(i + 1, len(moves)):
+            if scores[j] > scores[best]:
+                best = j
+        moves[i], moves[best] = moves[best], moves[i]
+        scores[i], scores[best] = scores[best], scores[i]
+        yield moves[i]
 
 
 def board_score(game_state):
+    # The side to move is the one that has been mated
     if game_state.check_mate:
         if game_state.is_white_move:
-            return CHECKMATE
-        else:
             return -CHECKMATE
+        else:
+            return CHECKMATE
 
     if game_state.stale_mate:
         return STALEMATE
 
-    board = game_state.board
-    score = 0
-    for row in range(len(board)):
-        for column in range(len(board[row])):
-            if board[row][column] != "__":
-                if board[row][column][0] == "w":
-                    score += piece_scores[board[row][column]][row][column]
-                else:
-                    score -= piece_scores[board[row][column]][row][column]
-    return score
+    # Material and piece positions, kept up to date by make_move/undo_move
+    return game_state.score
+
+
+# A tablebase result for the side to move as a score from white's point of
+# view. Wins and losses the fifty move rule turns into draws count as draws
+def tablebase_score(wdl, is_white_move):
+    score = TABLEBASE_WIN if wdl == 2 else -TABLEBASE_WIN if wdl == -2 else 0
+    return score if is_white_move else -score
+
+
+# Scores are kept in tenths of a pawn from white's point of view. For reporting
+# they are turned into ("cp", centipawns) or ("mate", moves to mate) for the
+# side to move, the way UCI reports them
+def reported_score(score, is_white_move, principal_variation):
+    if not is_white_move:
+        score = -score
+    if abs(score) >= CHECKMATE:
+        moves_to_mate = (len(principal_variation) + 1) // 2
+        return "mate", moves_to_mate if score > 0 else -moves_to_mate
+    return "cp", round(score * 10)
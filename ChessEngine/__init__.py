@@ -0,0 +1,2 @@
+# engine, AI, bitboard, perft and uci only need the standard library. main,
+# the pygame GUI, is only imported when it is run with python -m ChessEngine
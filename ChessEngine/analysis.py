@@ -0,0 +1,189 @@
+import argparse
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+from . import AI, bitboard, engine
+
+BACKENDS = {"list": engine.GameState, "bitboard": bitboard.BitboardGameState}
+
+COLUMNS = ["index", "id", "fen", "best_move", "score_type", "score", "depth",
+           "nodes", "time_ms", "pv", "error"]
+
+# Positions handed to the pool ahead of the one being written, per worker.
+# Enough to keep every worker busy while memory stays bounded
+QUEUED_PER_WORKER = 2
+
+# One Searcher per process, reused between positions
+searcher = None
+
+
+# Reads positions one at a time from a file of FEN or EPD lines, so the file
+# is never held in memory. Yields (index, id, fen, max_depth, time_limit_ms,
+# error), where the EPD opcodes "id", "acd" (depth) and "acs" (seconds)
+# override the defaults for that position, and error describes an opcode that
+# could not be read (None otherwise). Blank lines and lines starting with #
+# are skipped
+def read_positions(path, max_depth=AI.DEPTH, time_limit_ms=None):
+    index = 0
+    with open(path) as positions_file:
+        for line in positions_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split(None, 4)
+            fen_fields = fields[:4]
+            operations = fields[4] if len(fields) > 4 else ""
+            # A FEN has the two move counters where an EPD has its operations
+            counters = operations.split(None, 2)
+            if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():
+                fen_fields += counters[:2]
+                operations = counters[2] if len(counters) > 2 else ""
+
+            position_id, depth, limit = str(index), max_depth, time_limit_ms
+            error = None
+            for operation in operations.split(";"):
+                parts = operation.split(None, 1)
+                if len(parts) != 2:
+                    continue
+                opcode, operand = parts[0], parts[1].strip().strip('"')
+                try:
+                    if opcode == "id":
+                        position_id = operand
+                    elif opcode == "acd":
+                        depth = int(operand)
+                    elif opcode == "acs":
+                        limit = int(float(operand) * 1000)
+                except (ValueError, OverflowError):
+                    error = "Invalid {} opcode: {}".format(opcode, operand)
+            yield index, position_id, " ".join(fen_fields), depth, limit, error
+            index += 1
+
+
+# Runs in a worker process, returning one output row. A position that cannot
+# be read or searched gets its error in the row instead of ending the batch
+def analyse_position(game_state_class, index, position_id, fen, max_depth,
+                     time_limit_ms, error=None):
+    row = {column: None for column in COLUMNS}
+    row.update(index=index, id=position_id, fen=fen)
+    if error:
+        row["error"] = error
+        return row
+    try:
+        game_state = game_state_class.from_fen(fen)
+    except ValueError as error:
+        row["error"] = str(error)
+        return row
+    try:
+        search_position(game_state, max_depth, time_limit_ms, row)
+    except Exception as error:
+        row["error"] = "{}: {}".format(type(error).__name__, error)
+    return row
+
+
+# Fills in the search results of a row. The tables are cleared so a result
+# does not depend on which positions the worker searched before
+def search_position(game_state, max_depth, time_limit_ms, row):
+    global searcher
+    valid_moves = game_state.get_valid_moves()
+    if not valid_moves:
+        row["error"] = "checkmate" if game_state.check_mate else "stalemate"
+        return
+
+    if searcher is None:
+        searcher = AI.Searcher()
+    searcher.clear()
+    searcher.max_depth = max_depth
+    searcher.time_limit_ms = time_limit_ms
+    move = searcher.search(game_state, valid_moves)
+    principal_variation = searcher.principal_variation(game_state)
+    score_type, score = AI.reported_score(
+        searcher.best_score, game_state.is_white_move, principal_variation)
+    row.update(best_move=move.get_chess_notation, score_type=score_type,
+               score=score, depth=searcher.depth_reached, nodes=searcher.nodes,
+               time_ms=int(searcher.elapsed * 1000),
+               pv=" ".join(move.get_chess_notation for move in principal_variation))
+
+
+# Results come back in input order, so everything written so far is always
+# a complete prefix of the input
+def analyse_positions(positions, workers=AI.WORKERS,
+                      game_state_class=engine.GameState):
+    tasks = ((game_state_class,) + position for position in positions)
+    if workers <= 1:
+        for task in tasks:
+            yield analyse_position(*task)
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.submit(analyse_position, *task))
+            if len(pending) >= QUEUED_PER_WORKER * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# The output file is the checkpoint: every complete line is a finished
+# position. A line cut off by an interruption is removed so it gets redone.
+# Returns the number of positions already done
+def completed_positions(path, output_format):
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as output_file:
+        data = output_file.read()
+        complete_length = data.rfind(b"\n") + 1
+        output_file.truncate(complete_length)
+    lines = data[:complete_length].count(b"\n")
+    if output_format == "csv":
+        lines = max(0, lines - 1)
+    return lines
+
+
+def write_results(results, path, output_format, append=False):
+    with open(path, "a" if append else "w", newline="") as output_file:
+        if output_format == "csv":
+            writer = csv.DictWriter(output_file, COLUMNS)
+            if not append or output_file.tell() == 0:
+                writer.writeheader()
+        count = 0
+        for row in results:
+            if output_format == "csv":
+                writer.writerow(row)
+            else:
+                output_file.write(json.dumps(row) + "\n")
+            # Flushed per position so an interruption loses at most the
+            # positions still being searched
+            output_file.flush()
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse every position of a FEN/EPD file")
+    parser.add_argument("input", help="file with one FEN or EPD position per line")
+    parser.add_argument("output", help="results file, .csv for CSV, otherwise JSON lines")
+    parser.add_argument("--depth", type=int, default=AI.DEPTH)
+    parser.add_argument("--movetime", type=int, metavar="MS",
+                        help="time limit per position in milliseconds")
+    parser.add_argument("--workers", type=int, default=AI.WORKERS)
+    parser.add_argument("--backend", choices=list(BACKENDS), default="list")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the positions already in the output file")
+    arguments = parser.parse_args()
+
+    output_format = "csv" if arguments.output.endswith(".csv") else "jsonl"
+    skipped = 0
+    if arguments.resume:
+        skipped = completed_positions(arguments.output, output_format)
+    positions = itertools.islice(
+        read_positions(arguments.input, arguments.depth, arguments.movetime), skipped, None)
+    results = analyse_positions(positions, arguments.workers, BACKENDS[arguments.backend])
+    count = write_results(results, arguments.output, output_format, append=arguments.resume)
+    print("Analysed {} positions ({} already done)".format(count, skipped))
+
+
+if __name__ == "__main__":
+    main()
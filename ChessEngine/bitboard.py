@@ -0,0 +1,729 @@
+from . import engine
+
+# Squares are indexed as row * 8 + column, so bit 0 is a8 and bit 63 is h1,
+# matching the row/column layout of GameState.board
+PIECES = ["wP", "wN", "wB", "wR", "wQ", "wK",
+          "bP", "bN", "bB", "bR", "bQ", "bK"]
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+# A piece is indexed by its color plus its type, e.g. BLACK + ROOK is "bR"
+WHITE, BLACK = 0, 6
+COLORS = {"w": WHITE, "b": BLACK}
+EMPTY = 12
+PIECE_NAMES = PIECES + ["__"]
+
+FULL_BOARD = (1 << 64) - 1
+
+# Moves are ints. The lowest 15 bits are the move_id of engine.Move (start
+# square, end square, promotion), above them are the piece moved, the piece
+# captured (EMPTY for none) and the enpassant and castling flags
+PIECE_SHIFT = 15
+CAPTURED_SHIFT = 19
+ENPASSANT_FLAG = 1 << 23
+CASTLING_FLAG = 1 << 24
+MOVE_ID_MASK = (1 << 15) - 1
+NO_CAPTURE = EMPTY << CAPTURED_SHIFT
+# Promotion codes are the index in engine.PROMOTION_PIECES plus one
+PROMOTION_TYPES = [None, QUEEN, ROOK, BISHOP, KNIGHT]
+
+
+def square_bit(row, column):
+    return 1 << (row * 8 + column)
+
+
+def bit_scan(bitboard):
+    # Index of the least significant set bit
+    return (bitboard & -bitboard).bit_length() - 1
+
+
+def iterate_bits(bitboard):
+    while bitboard:
+        lowest_bit = bitboard & -bitboard
+        yield lowest_bit.bit_length() - 1
+        bitboard ^= lowest_bit
+
+
+def leaper_attacks(offsets):
+    table = []
+    for square in range(64):
+        row, column = divmod(square, 8)
+        attacks = 0
+        for row_offset, column_offset in offsets:
+            if 0 <= row + row_offset <= 7 and 0 <= column + column_offset <= 7:
+                attacks |= square_bit(row + row_offset, column + column_offset)
+        table.append(attacks)
+    return table
+
+
+def ray_masks(row_offset, column_offset):
+    table = []
+    for square in range(64):
+        row, column = divmod(square, 8)
+        ray = 0
+        row, column = row + row_offset, column + column_offset
+        while 0 <= row <= 7 and 0 <= column <= 7:
+            ray |= square_bit(row, column)
+            row, column = row + row_offset, column + column_offset
+        table.append(ray)
+    return table
+
+
+KNIGHT_ATTACKS = leaper_attacks([(2, 1), (2, -1), (1, 2), (1, -2),
+                                 (-1, 2), (-1, -2), (-2, 1), (-2, -1)])
+KING_ATTACKS = leaper_attacks([(1, 0), (1, 1), (0, 1), (-1, 1),
+                               (-1, 0), (-1, -1), (0, -1), (1, -1)])
+# Squares attacked by a pawn of the given color standing on a square
+PAWN_ATTACKS = {WHITE: leaper_attacks([(-1, -1), (-1, 1)]),
+                BLACK: leaper_attacks([(1, -1), (1, 1)])}
+
+# (ray table, True if the ray runs towards higher square indices)
+ORTHOGONAL_RAYS = [(ray_masks(-1, 0), False), (ray_masks(1, 0), True),
+                   (ray_masks(0, -1), False), (ray_masks(0, 1), True)]
+DIAGONAL_RAYS = [(ray_masks(-1, -1), False), (ray_masks(-1, 1), False),
+                 (ray_masks(1, -1), True), (ray_masks(1, 1), True)]
+QUEEN_RAYS = ORTHOGONAL_RAYS + DIAGONAL_RAYS
+
+RANK_MASKS = [0xFF << (8 * row) for row in range(8)]
+PROMOTION_RANKS = RANK_MASKS[0] | RANK_MASKS[7]
+NOT_A_FILE = FULL_BOARD ^ sum(square_bit(row, 0) for row in range(8))
+NOT_H_FILE = FULL_BOARD ^ sum(square_bit(row, 7) for row in range(8))
+
+# Zobrist keys and piece square scores of engine, by piece index and square,
+# so the keys and scores come out the same as with GameState. Scores are
+# negative for black pieces
+ZOBRIST = [[engine.ZOBRIST_PIECES[piece][square >> 3][square & 7] for square in range(64)]
+           for piece in PIECES]
+SCORES = [[(1 if piece[0] == "w" else -1) * engine.piece_scores[piece][square >> 3][square & 7]
+           for square in range(64)] for piece in PIECES]
+
+# Castling rights are bits in the order of GameState.castle_rights_log entries
+WHITE_QUEEN_SIDE, WHITE_KING_SIDE, BLACK_QUEEN_SIDE, BLACK_KING_SIDE = 1, 2, 4, 8
+# The key of every combination of rights, for toggling all that changed at once
+ZOBRIST_CASTLING = [0] * 16
+for rights in range(16):
+    for i in range(4):
+        if rights >> i & 1:
+            ZOBRIST_CASTLING[rights] ^= engine.ZOBRIST_CASTLING[i]
+# Rights kept when a move starts or ends on a square, moving the king or a
+# rook or capturing a rook in its corner loses them
+CASTLING_KEPT = [15] * 64
+CASTLING_KEPT[56] = 15 ^ WHITE_QUEEN_SIDE
+CASTLING_KEPT[63] = 15 ^ WHITE_KING_SIDE
+CASTLING_KEPT[60] = 15 ^ WHITE_QUEEN_SIDE ^ WHITE_KING_SIDE
+CASTLING_KEPT[0] = 15 ^ BLACK_QUEEN_SIDE
+CASTLING_KEPT[7] = 15 ^ BLACK_KING_SIDE
+CASTLING_KEPT[4] = 15 ^ BLACK_QUEEN_SIDE ^ BLACK_KING_SIDE
+
+# Castling: (right, king square, king target, rook square, squares that must
+# be empty, squares the king crosses that must not be attacked)
+CASTLING = {
+    WHITE: [(WHITE_KING_SIDE, 60, 62, 63, square_bit(7, 5) | square_bit(7, 6), [61, 62]),
+            (WHITE_QUEEN_SIDE, 60, 58, 56,
+             square_bit(7, 1) | square_bit(7, 2) | square_bit(7, 3), [59, 58])],
+    BLACK: [(BLACK_KING_SIDE, 4, 6, 7, square_bit(0, 5) | square_bit(0, 6), [5, 6]),
+            (BLACK_QUEEN_SIDE, 4, 2, 0,
+             square_bit(0, 1) | square_bit(0, 2) | square_bit(0, 3), [3, 2])]
+}
+# Rook squares before and after castling, by the king's target square
+CASTLING_ROOKS = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+
+
+# Walking the rays, used to fill the LINE tables below
+def ray_attacks(square, occupied, rays):
+    attacks = 0
+    for ray_table, is_positive in rays:
+        ray = ray_table[square]
+        blockers = ray & occupied
+        if blockers:
+            # The nearest blocker stops the ray, but is itself attacked
+            if is_positive:
+                blocker = bit_scan(blockers)
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= ray_table[blocker]
+        attacks |= ray
+    return attacks
+
+
+# For every square, a (mask, attacks) pair for each line through it made of
+# two opposite rays, attacks being a dictionary from the occupied squares
+# under the mask to the squares attacked along the line. The last square of
+# each ray is left out of the mask, it is attacked whether occupied or not
+def line_attacks(ray_pairs):
+    lines = []
+    for square in range(64):
+        square_lines = []
+        for rays in ray_pairs:
+            mask = 0
+            for ray_table, is_positive in rays:
+                ray = ray_table[square]
+                if ray:
+                    ray ^= 1 << (ray.bit_length() - 1 if is_positive else bit_scan(ray))
+                mask |= ray
+            attacks = {}
+            # Every subset of the mask, by the carry-rippler trick
+            occupied = 0
+            while True:
+                attacks[occupied] = ray_attacks(square, occupied, rays)
+                occupied = (occupied - mask) & mask
+                if not occupied:
+                    break
+            square_lines.append((mask, attacks))
+        lines.append(square_lines)
+    return lines
+
+
+ORTHOGONAL_LINES = line_attacks([ORTHOGONAL_RAYS[:2], ORTHOGONAL_RAYS[2:]])
+DIAGONAL_LINES = line_attacks([[DIAGONAL_RAYS[0], DIAGONAL_RAYS[3]],
+                               [DIAGONAL_RAYS[1], DIAGONAL_RAYS[2]]])
+QUEEN_LINES = [ORTHOGONAL_LINES[square] + DIAGONAL_LINES[square] for square in range(64)]
+PIECE_LINES = [(KNIGHT, None), (BISHOP, DIAGONAL_LINES), (ROOK, ORTHOGONAL_LINES),
+               (QUEEN, QUEEN_LINES)]
+
+
+def slider_attacks(square, occupied, lines):
+    attacks = 0
+    for mask, line_attacks in lines[square]:
+        attacks |= line_attacks[occupied & mask]
+    return attacks
+
+
+def is_square_attacked(square, by_color, bitboards, occupied):
+    defender_color = BLACK if by_color == WHITE else WHITE
+    if PAWN_ATTACKS[defender_color][square] & bitboards[by_color + PAWN]:
+        return True
+    if KNIGHT_ATTACKS[square] & bitboards[by_color + KNIGHT]:
+        return True
+    if KING_ATTACKS[square] & bitboards[by_color + KING]:
+        return True
+    diagonal = bitboards[by_color + BISHOP] | bitboards[by_color + QUEEN]
+    if diagonal and slider_attacks(square, occupied, DIAGONAL_LINES) & diagonal:
+        return True
+    orthogonal = bitboards[by_color + ROOK] | bitboards[by_color + QUEEN]
+    if orthogonal and slider_attacks(square, occupied, ORTHOGONAL_LINES) & orthogonal:
+        return True
+    return False
+
+
+# Bitboard of the pieces of by_color attacking the square
+def attackers(square, by_color, bitboards, occupied):
+    defender_color = BLACK if by_color == WHITE else WHITE
+    found = PAWN_ATTACKS[defender_color][square] & bitboards[by_color + PAWN] | \
+        KNIGHT_ATTACKS[square] & bitboards[by_color + KNIGHT] | \
+        KING_ATTACKS[square] & bitboards[by_color + KING]
+    diagonal = bitboards[by_color + BISHOP] | bitboards[by_color + QUEEN]
+    if diagonal:
+        found |= slider_attacks(square, occupied, DIAGONAL_LINES) & diagonal
+    orthogonal = bitboards[by_color + ROOK] | bitboards[by_color + QUEEN]
+    if orthogonal:
+        found |= slider_attacks(square, occupied, ORTHOGONAL_LINES) & orthogonal
+    return found
+
+
+# Squares strictly between two squares on a line, none when they share no line
+def squares_between(square, other_square):
+    for ray_table, _ in QUEEN_RAYS:
+        if (ray_table[square] >> other_square) & 1:
+            return ray_table[square] & ~ray_table[other_square] & ~(1 << other_square)
+    return 0
+
+
+# For every own piece pinned to the king, the squares it may still move to:
+# the line from the king up to and including the pinning piece
+def pin_lines(king_square, own, occupied, orthogonal_sliders, diagonal_sliders):
+    lines = {}
+    for rays, sliders in ((ORTHOGONAL_RAYS, orthogonal_sliders),
+                          (DIAGONAL_RAYS, diagonal_sliders)):
+        if not sliders:
+            continue
+        for ray_table, is_positive in rays:
+            ray = ray_table[king_square]
+            blockers = ray & occupied
+            if not blockers:
+                continue
+            first = bit_scan(blockers) if is_positive else blockers.bit_length() - 1
+            if not (own >> first) & 1:
+                continue
+            blockers ^= 1 << first
+            if not blockers:
+                continue
+            second = bit_scan(blockers) if is_positive else blockers.bit_length() - 1
+            if (sliders >> second) & 1:
+                lines[first] = ray & ~ray_table[second]
+    return lines
+
+
+# A move of BitboardGameState. It is a plain int to make_move and undo_move,
+# the attributes of engine.Move are there for the search, the GUI and PGN
+class BitboardMove(int):
+    __slots__ = ()
+
+    ranks_to_rows = engine.Move.ranks_to_rows
+    rows_to_ranks = engine.Move.rows_to_ranks
+    files_to_columns = engine.Move.files_to_columns
+    columns_to_files = engine.Move.columns_to_files
+    get_chess_notation = engine.Move.get_chess_notation
+    get_rank_file = engine.Move.get_rank_file
+
+    @property
+    def move_id(self):
+        return self & MOVE_ID_MASK
+
+    @property
+    def start_row(self):
+        return self >> 3 & 7
+
+    @property
+    def start_column(self):
+        return self & 7
+
+    @property
+    def end_row(self):
+        return self >> 9 & 7
+
+    @property
+    def end_column(self):
+        return self >> 6 & 7
+
+    @property
+    def piece_moved(self):
+        return PIECE_NAMES[self >> PIECE_SHIFT & 15]
+
+    @property
+    def piece_captured(self):
+        return PIECE_NAMES[self >> CAPTURED_SHIFT & 15]
+
+    @property
+    def is_enpassant_move(self):
+        return bool(self & ENPASSANT_FLAG)
+
+    @property
+    def is_castling_move(self):
+        return bool(self & CASTLING_FLAG)
+
+    @property
+    def is_pawn_promotion(self):
+        return bool(self >> 12 & 7)
+
+    # "Q" when not promoting, like engine.Move
+    @property
+    def promotion_piece(self):
+        return engine.PROMOTION_PIECES[(self >> 12 & 7 or 1) - 1]
+
+
+# A game state kept only as one bitboard per piece, with the same interface as
+# engine.GameState so the search, UCI, analysis and PGN code can use either.
+# make_move and undo_move only toggle the bits of the squares a move changes
+# and keep the rest of the position on a history stack. The 8x8 board is
+# built from the bitboards when something asks for it
+class BitboardGameState():
+    def __init__(self):
+        self.load_game_state(engine.GameState())
+
+    @classmethod
+    def from_fen(cls, fen):
+        game_state = cls()
+        game_state.load_fen(fen)
+        return game_state
+
+    # The FEN is read (and checked) by GameState
+    def load_fen(self, fen):
+        self.load_game_state(engine.GameState.from_fen(fen))
+
+    def load_game_state(self, game_state):
+        self.bitboards = [0] * len(PIECES)
+        self.occupancy = {WHITE: 0, BLACK: 0}
+        for row in range(8):
+            for column in range(8):
+                piece = game_state.board[row][column]
+                if piece != "__":
+                    index = PIECES.index(piece)
+                    self.bitboards[index] |= square_bit(row, column)
+                    self.occupancy[COLORS[piece[0]]] |= square_bit(row, column)
+        self.is_white_move = game_state.is_white_move
+        self.castling = \
+            (WHITE_QUEEN_SIDE if game_state.white_queen_side_castling else 0) | \
+            (WHITE_KING_SIDE if game_state.white_king_side_castling else 0) | \
+            (BLACK_QUEEN_SIDE if game_state.black_queen_side_castling else 0) | \
+            (BLACK_KING_SIDE if game_state.black_king_side_castling else 0)
+        if game_state.enpassant_possible:
+            self.enpassant_square = game_state.enpassant_possible[0] * 8 + \
+                game_state.enpassant_possible[1]
+        else:
+            self.enpassant_square = -1
+        self.halfmove_clock = game_state.halfmove_clock
+        self.fullmove_number = game_state.fullmove_number
+        self.zobrist_key = game_state.zobrist_key
+        self.score = game_state.score
+        self.check_mate = False
+        self.stale_mate = False
+        self.move_log = []
+        # (castling, enpassant square, halfmove clock, key, score) before
+        # each move of move_log
+        self.history = []
+
+    # The position in the form GameState keeps it, for the GUI, the opening
+    # book, PGN and FEN export
+    @property
+    def board(self):
+        board = [["__"] * 8 for row in range(8)]
+        for piece in range(len(PIECES)):
+            for square in iterate_bits(self.bitboards[piece]):
+                board[square >> 3][square & 7] = PIECES[piece]
+        return board
+
+    @property
+    def enpassant_possible(self):
+        if self.enpassant_square < 0:
+            return ()
+        return self.enpassant_square >> 3, self.enpassant_square & 7
+
+    @property
+    def white_queen_side_castling(self):
+        return bool(self.castling & WHITE_QUEEN_SIDE)
+
+    @property
+    def white_king_side_castling(self):
+        return bool(self.castling & WHITE_KING_SIDE)
+
+    @property
+    def black_queen_side_castling(self):
+        return bool(self.castling & BLACK_QUEEN_SIDE)
+
+    @property
+    def black_king_side_castling(self):
+        return bool(self.castling & BLACK_KING_SIDE)
+
+    # These only read the board, side to move, castling rights, enpassant
+    # square and move counters, all of which are there as attributes above
+    get_fen = engine.GameState.get_fen
+    compute_zobrist_key = engine.GameState.compute_zobrist_key
+    compute_score = engine.GameState.compute_score
+
+    # Flipping the bits of every square the move changes. Doing it a second
+    # time takes the move back
+    def toggle_move_bits(self, move):
+        bitboards = self.bitboards
+        start_bit = 1 << (move & 63)
+        end = move >> 6 & 63
+        end_bit = 1 << end
+        piece = move >> PIECE_SHIFT & 15
+        color = WHITE if piece < BLACK else BLACK
+        promotion = move >> 12 & 7
+        bitboards[piece] ^= start_bit
+        if promotion:
+            bitboards[color + PROMOTION_TYPES[promotion]] ^= end_bit
+        else:
+            bitboards[piece] ^= end_bit
+        self.occupancy[color] ^= start_bit | end_bit
+
+        captured = move >> CAPTURED_SHIFT & 15
+        if captured != EMPTY:
+            if move & ENPASSANT_FLAG:
+                # Beside the start square, on the column of the end square
+                captured_bit = 1 << ((move & 56) | (end & 7))
+            else:
+                captured_bit = end_bit
+            bitboards[captured] ^= captured_bit
+            self.occupancy[BLACK if color == WHITE else WHITE] ^= captured_bit
+        elif move & CASTLING_FLAG:
+            rook_start, rook_end = CASTLING_ROOKS[end]
+            rook_bits = 1 << rook_start | 1 << rook_end
+            bitboards[color + ROOK] ^= rook_bits
+            self.occupancy[color] ^= rook_bits
+
+    def make_move(self, move):
+        self.history.append((self.castling, self.enpassant_square, self.halfmove_clock,
+                             self.zobrist_key, self.score))
+        self.toggle_move_bits(move)
+
+        start = move & 63
+        end = move >> 6 & 63
+        piece = move >> PIECE_SHIFT & 15
+        color = WHITE if piece < BLACK else BLACK
+        promotion = move >> 12 & 7
+        placed = color + PROMOTION_TYPES[promotion] if promotion else piece
+        key = self.zobrist_key ^ ZOBRIST[piece][start] ^ ZOBRIST[placed][end] ^ \
+            engine.ZOBRIST_BLACK_TO_MOVE
+        score = self.score - SCORES[piece][start] + SCORES[placed][end]
+
+        captured = move >> CAPTURED_SHIFT & 15
+        if captured != EMPTY:
+            captured_square = (start & 56) | (end & 7) if move & ENPASSANT_FLAG else end
+            key ^= ZOBRIST[captured][captured_square]
+            score -= SCORES[captured][captured_square]
+            self.halfmove_clock = 0
+        elif piece == color + PAWN:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+            if move & CASTLING_FLAG:
+                rook = color + ROOK
+                rook_start, rook_end = CASTLING_ROOKS[end]
+                key ^= ZOBRIST[rook][rook_start] ^ ZOBRIST[rook][rook_end]
+                score += SCORES[rook][rook_end] - SCORES[rook][rook_start]
+
+        if self.enpassant_square >= 0:
+            key ^= engine.ZOBRIST_ENPASSANT[self.enpassant_square & 7]
+        if piece == color + PAWN and (end - start == 16 or start - end == 16):
+            self.enpassant_square = (start + end) >> 1
+            key ^= engine.ZOBRIST_ENPASSANT[start & 7]
+        else:
+            self.enpassant_square = -1
+
+        castling = self.castling
+        if castling:
+            self.castling = castling & CASTLING_KEPT[start] & CASTLING_KEPT[end]
+            key ^= ZOBRIST_CASTLING[castling ^ self.castling]
+
+        if color == BLACK:
+            self.fullmove_number += 1
+        self.zobrist_key = key
+        self.score = score
+        self.is_white_move = not self.is_white_move
+        self.move_log.append(move)
+
+        if engine.DEBUG_INCREMENTAL:
+            assert self.zobrist_key == self.compute_zobrist_key()
+            assert self.score == self.compute_score()
+
+    def undo_move(self):
+        move = self.move_log.pop()
+        self.toggle_move_bits(move)
+        self.castling, self.enpassant_square, self.halfmove_clock, self.zobrist_key, \
+            self.score = self.history.pop()
+        if move >> PIECE_SHIFT & 15 >= BLACK:
+            self.fullmove_number -= 1
+        self.is_white_move = not self.is_white_move
+        self.check_mate = False
+        self.stale_mate = False
+
+    def get_valid_moves(self):
+        all_valid_moves, in_check = self.get_legal_moves()
+
+        if all_valid_moves:
+            self.stale_mate = False
+            self.check_mate = False
+        elif in_check:
+            self.check_mate = True
+        else:
+            self.stale_mate = True
+
+        return all_valid_moves
+
+    # Legal captures and queen promotions only, used by the quiescence search.
+    # Unlike get_valid_moves it leaves check_mate and stale_mate untouched
+    def get_capture_moves(self):
+        return self.get_legal_moves(captures_only=True)[0]
+
+    # Legal moves of the piece on one square, so that a single move such as a
+    # hash or killer move can be checked without generating all the others
+    def get_piece_moves(self, row, column):
+        return self.get_legal_moves(from_squares=square_bit(row, column))[0]
+
+    def is_square_attacked(self, row, column, by_color):
+        occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        return is_square_attacked(row * 8 + column, COLORS[by_color], self.bitboards, occupied)
+
+    def in_check(self):
+        color, enemy_color = (WHITE, BLACK) if self.is_white_move else (BLACK, WHITE)
+        king = self.bitboards[color + KING]
+        return bool(king) and is_square_attacked(
+            king.bit_length() - 1, enemy_color, self.bitboards,
+            self.occupancy[WHITE] | self.occupancy[BLACK])
+
+    # Returns (moves, in_check) for the pieces on from_squares. Checks and pins
+    # are found once up front, so a move only has to land on an allowed
+    # square. Enpassant alone is tested by playing it on the bitboards
+    def get_legal_moves(self, captures_only=False, from_squares=FULL_BOARD):
+        color, enemy_color = (WHITE, BLACK) if self.is_white_move else (BLACK, WHITE)
+        bitboards = self.bitboards
+        own = self.occupancy[color]
+        enemy = self.occupancy[enemy_color]
+        occupied = own | enemy
+        # Squares pieces may land on, only enemy pieces when generating captures
+        targets = enemy if captures_only else FULL_BOARD ^ own
+
+        king = bitboards[color + KING]
+        king_square = king.bit_length() - 1
+        checkers = attackers(king_square, enemy_color, bitboards, occupied) if king else 0
+
+        moves = []
+        # In double check only the king can move
+        if not checkers & (checkers - 1):
+            if checkers:
+                # Capturing the checking piece or stepping in its way
+                evasions = checkers | squares_between(king_square, bit_scan(checkers))
+            else:
+                evasions = FULL_BOARD
+            if king:
+                pins = pin_lines(king_square, own, occupied,
+                                 bitboards[enemy_color + ROOK] | bitboards[enemy_color + QUEEN],
+                                 bitboards[enemy_color + BISHOP] | bitboards[enemy_color + QUEEN])
+            else:
+                pins = {}
+            pawns = bitboards[color + PAWN] & from_squares
+            if pawns:
+                self.add_pawn_moves(moves, pawns, color, enemy_color, occupied,
+                                    evasions, pins, captures_only)
+                if self.enpassant_square >= 0:
+                    self.add_enpassant_moves(moves, pawns, color, enemy_color, occupied,
+                                             king_square if king else -1)
+            for piece_type, lines in PIECE_LINES:
+                pieces = bitboards[color + piece_type] & from_squares
+                if pieces:
+                    self.add_piece_moves(moves, color + piece_type, pieces, lines, enemy_color,
+                                         occupied, targets & evasions, pins)
+
+        if king & from_squares:
+            self.add_king_moves(moves, king_square, color, enemy_color, occupied, targets)
+            if not checkers and not captures_only and self.castling:
+                self.add_castling_moves(moves, color, enemy_color, occupied)
+
+        return moves, checkers != 0
+
+    # Pushes and captures of all pawns at once by shifting the pawn bitboard,
+    # pinned pawns one at a time with their pin line as a limit
+    def add_pawn_moves(self, moves, pawns, color, enemy_color, occupied, evasions, pins,
+                       captures_only):
+        pinned = 0
+        for square in pins:
+            if pawns >> square & 1:
+                pinned |= 1 << square
+        if pinned:
+            pawns ^= pinned
+            for square in iterate_bits(pinned):
+                self.add_pawn_moves(moves, 1 << square, color, enemy_color, occupied,
+                                    evasions & pins[square], {}, captures_only)
+
+        bitboards = self.bitboards
+        enemy = self.occupancy[enemy_color]
+        empty = FULL_BOARD ^ occupied
+        # (end squares, start square minus end square, is a capture)
+        if color == WHITE:
+            pushes = pawns >> 8 & empty
+            double_pushes = (pushes & RANK_MASKS[5]) >> 8 & empty
+            stages = [(pushes, 8, False), (double_pushes, 16, False),
+                      ((pawns & NOT_A_FILE) >> 9 & enemy, 9, True),
+                      ((pawns & NOT_H_FILE) >> 7 & enemy, 7, True)]
+        else:
+            pushes = pawns << 8 & empty
+            double_pushes = (pushes & RANK_MASKS[2]) << 8 & empty
+            stages = [(pushes, -8, False), (double_pushes, -16, False),
+                      ((pawns & NOT_A_FILE) << 7 & enemy, -7, True),
+                      ((pawns & NOT_H_FILE) << 9 & enemy, -9, True)]
+        if captures_only:
+            # Pushes only count when they promote
+            stages[0] = (pushes & PROMOTION_RANKS, stages[0][1], False)
+            stages[1] = (0, 0, False)
+            promotion_codes = (1,)
+        else:
+            promotion_codes = (1, 2, 3, 4)
+
+        base = (color + PAWN) << PIECE_SHIFT
+        for ends, offset, is_capture in stages:
+            ends &= evasions
+            while ends:
+                end_bit = ends & -ends
+                ends ^= end_bit
+                end = end_bit.bit_length() - 1
+                move = base | (end + offset) | end << 6
+                if is_capture:
+                    captured = enemy_color
+                    while not bitboards[captured] & end_bit:
+                        captured += 1
+                    move |= captured << CAPTURED_SHIFT
+                else:
+                    move |= NO_CAPTURE
+                if end_bit & PROMOTION_RANKS:
+                    for code in promotion_codes:
+                        moves.append(BitboardMove(move | code << 12))
+                else:
+                    moves.append(BitboardMove(move))
+
+    # Enpassant takes two pawns off one row at once, which can expose the king
+    # along that row, so every enpassant capture is played on the bitboards
+    # and taken back again
+    def add_enpassant_moves(self, moves, pawns, color, enemy_color, occupied, king_square):
+        end = self.enpassant_square
+        bitboards = self.bitboards
+        enemy_pawn = enemy_color + PAWN
+        for start in iterate_bits(PAWN_ATTACKS[enemy_color][end] & pawns):
+            captured_bit = 1 << ((start & 56) | (end & 7))
+            if king_square >= 0:
+                bitboards[enemy_pawn] ^= captured_bit
+                legal = not is_square_attacked(
+                    king_square, enemy_color, bitboards,
+                    occupied ^ (1 << start) ^ captured_bit | (1 << end))
+                bitboards[enemy_pawn] ^= captured_bit
+                if not legal:
+                    continue
+            moves.append(BitboardMove((color + PAWN) << PIECE_SHIFT | start | end << 6 |
+                                      enemy_pawn << CAPTURED_SHIFT | ENPASSANT_FLAG))
+
+    def add_piece_moves(self, moves, piece, pieces, lines, enemy_color, occupied, targets, pins):
+        bitboards = self.bitboards
+        enemy = self.occupancy[enemy_color]
+        base = piece << PIECE_SHIFT
+        while pieces:
+            start_bit = pieces & -pieces
+            pieces ^= start_bit
+            start = start_bit.bit_length() - 1
+            if lines is None:
+                ends = KNIGHT_ATTACKS[start] & targets
+            else:
+                ends = 0
+                for mask, line_attacks in lines[start]:
+                    ends |= line_attacks[occupied & mask]
+                ends &= targets
+            if start in pins:
+                ends &= pins[start]
+            move = base | start
+            captures = ends & enemy
+            ends ^= captures
+            while ends:
+                end_bit = ends & -ends
+                ends ^= end_bit
+                moves.append(BitboardMove(move | (end_bit.bit_length() - 1) << 6 | NO_CAPTURE))
+            while captures:
+                end_bit = captures & -captures
+                captures ^= end_bit
+                captured = enemy_color
+                while not bitboards[captured] & end_bit:
+                    captured += 1
+                moves.append(BitboardMove(move | (end_bit.bit_length() - 1) << 6 |
+                                          captured << CAPTURED_SHIFT))
+
+    # The king is taken off the board for the attack test, so it does not
+    # shield the squares behind it from a slider checking it. A captured piece
+    # never attacks its own square, so it does not need removing
+    def add_king_moves(self, moves, king_square, color, enemy_color, occupied, targets):
+        bitboards = self.bitboards
+        occupied_without_king = occupied ^ (1 << king_square)
+        move = (color + KING) << PIECE_SHIFT | king_square
+        ends = KING_ATTACKS[king_square] & targets
+        while ends:
+            end_bit = ends & -ends
+            ends ^= end_bit
+            end = end_bit.bit_length() - 1
+            if is_square_attacked(end, enemy_color, bitboards, occupied_without_king):
+                continue
+            if end_bit & occupied:
+                captured = enemy_color
+                while not bitboards[captured] & end_bit:
+                    captured += 1
+            else:
+                captured = EMPTY
+            moves.append(BitboardMove(move | end << 6 | captured << CAPTURED_SHIFT))
+
+    # Castling out of check is ruled out by the caller
+    def add_castling_moves(self, moves, color, enemy_color, occupied):
+        for right, king_start, king_end, rook_square, empty_squares, crossed_squares \
+                in CASTLING[color]:
+            if not self.castling & right or occupied & empty_squares or \
+                    not self.bitboards[color + ROOK] >> rook_square & 1:
+                continue
+            if any(is_square_attacked(square, enemy_color, self.bitboards, occupied)
+                   for square in crossed_squares):
+                continue
+            moves.append(BitboardMove((color + KING) << PIECE_SHIFT | king_start |
+                                      king_end << 6 | NO_CAPTURE | CASTLING_FLAG))
@@ -1,3 +1,201 @@
+import random
+
+# Orthogonal directions first, then diagonals, as (row offset, column offset)
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1),
+              (-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_JUMPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                (1, -2), (1, 2), (2, -1), (2, 1))
+PROMOTION_PIECES = ("Q", "R", "B", "N")
+
+
+# For every square, the squares reached with each offset that stay on the board
+def square_targets(offsets):
+    return [[[(row + row_offset, column + column_offset)
+              for row_offset, column_offset in offsets
+              if 0 <= row + row_offset <= 7 and 0 <= column + column_offset <= 7]
+             for column in range(8)] for row in range(8)]
+
+
+# For every square, the squares along each of the DIRECTIONS up to the edge of
+# the board, nearest first
+def square_rays():
+    rays = [[[] for column in range(8)] for row in range(8)]
+    for row in range(8):
+        for column in range(8):
+            for row_offset, column_offset in DIRECTIONS:
+                ray = []
+                end_row, end_column = row + row_offset, column + column_offset
+                while 0 <= end_row <= 7 and 0 <= end_column <= 7:
+                    ray.append((end_row, end_column))
+                    end_row += row_offset
+                    end_column += column_offset
+                rays[row][column].append(ray)
+    return rays
+
+
+KNIGHT_TARGETS = square_targets(KNIGHT_JUMPS)
+KING_TARGETS = square_targets(DIRECTIONS)
+# Squares a pawn of the color has to stand on to attack a square
+PAWN_ATTACKERS = {"w": square_targets(((1, -1), (1, 1))),
+                  "b": square_targets(((-1, -1), (-1, 1)))}
+RAYS = square_rays()
+# Which of the RAYS each sliding piece moves along
+ROOK_RAYS = (0, 1, 2, 3)
+BISHOP_RAYS = (4, 5, 6, 7)
+QUEEN_RAYS = ROOK_RAYS + BISHOP_RAYS
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Zobrist keys, seeded so the same position hashes the same between runs
+zobrist_random = random.Random(2021)
+ZOBRIST_PIECES = {piece: [[zobrist_random.getrandbits(64) for column in range(8)]
+                          for row in range(8)]
+                  for piece in ["wP", "wN", "wB", "wR", "wQ", "wK",
+                                "bP", "bN", "bB", "bR", "bQ", "bK"]}
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+# Same order as the castle_rights_log entries
+ZOBRIST_CASTLING = [zobrist_random.getrandbits(64) for i in range(4)]
+ZOBRIST_ENPASSANT = [zobrist_random.getrandbits(64) for column in range(8)]
+
+# Recomputing the Zobrist key and the score from scratch after every move,
+# slow but catches any incremental update that went out of sync
+DEBUG_INCREMENTAL = False
+
+# score of piece = piece personal score - positional score on board
+piece_scores = {
+    "wK": [
+        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
+        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
+        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
+        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
+        [900 - 2, 900 - 3, 900 - 3, 900 - 4, 900 - 4, 900 - 3, 900 - 3, 900 - 2],
+        [900 - 1, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 1],
+        [900 + 2, 900 + 2, 900 + 0, 900 + 0, 900 + 0, 900 + 0, 900 + 2, 900 + 2],
+        [900 + 2, 900 + 3, 900 + 1, 900 + 0, 900 + 0, 900 + 1, 900 + 3, 900 + 2]
+    ],
+    "bK": [
+        [900 + 2, 900 + 3, 900 + 1, 900 + 0, 900 + 0, 900 + 1, 900 + 3, 900 + 2],
+        [900 + 2, 900 + 2, 900 + 0, 900 + 0, 900 + 0, 900 + 0, 900 + 2, 900 + 2],
+        [900 - 1, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 2, 900 - 1],
+        [900 - 2, 900 - 3, 900 - 3, 900 - 4, 900 - 4, 900 - 3, 900 - 3, 900 - 2],
+        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
+        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
+        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3],
+        [900 - 3, 900 - 4, 900 - 4, 900 - 5, 900 - 5, 900 - 4, 900 - 4, 900 - 3]
+    ],
+    "wQ": [
+        [90 - 2, 90 - 1, 90 - 1, 90 - .5, 90 - .5, 90 - 1, 90 - 1, 90 - 2],
+        [90 - 1, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 1],
+        [90 - 1, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - 1],
+        [90 - .5, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - .5],
+        [90 - 0, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - .5],
+        [90 - 1, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - 1],
+        [90 - 1, 90 - 0, 90 + .5, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 1],
+        [90 - 2, 90 - 1, 90 - 1, 90 - .5, 90 - .5, 90 - 1, 90 - 1, 90 - 2]
+    ],
+    "bQ": [
+        [90 - 2, 90 - 1, 90 - 1, 90 - .5, 90 - .5, 90 - 1, 90 - 1, 90 - 2],
+        [90 - 1, 90 - 0, 90 + 0, 90 - 0, 90 - 0, 90 + .5, 90 - 0, 90 - 1],
+        [90 - 1, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 1],
+        [90 - .5, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - 0],
+        [90 - .5, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - .5],
+        [90 - 1, 90 - 0, 90 + .5, 90 + .5, 90 + .5, 90 + .5, 90 - 0, 90 - 1],
+        [90 - 1, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 0, 90 - 1],
+        [90 - 2, 90 - 1, 90 - 1, 90 - .5, 90 - .5, 90 - 1, 90 - 1, 90 - 2]
+    ],
+    "wR": [
+        [50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0],
+        [50 + .5, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + .5],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 + 0, 50 + 0, 50 + 0, 50 + .5, 50 + .5, 50 + 0, 50 + 0, 50 + 0]
+    ],
+    "bR": [
+        [50 + 0, 50 + 0, 50 + 0, 50 + .5, 50 + .5, 50 + 0, 50 + 0, 50 + 0],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 - .5, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 - .5],
+        [50 + .5, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + 1, 50 + .5],
+        [50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0, 50 + 0]
+    ],
+    "wB": [
+        [30 - 2, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 2],
+        [30 - 1, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 1],
+        [30 - 1, 30 - 0, 30 + .5, 30 + 1, 30 + 1, 30 + .5, 30 - 0, 30 - 1],
+        [30 - 1, 30 + .5, 30 + .5, 30 + 1, 30 + 1, 30 + .5, 30 + .5, 30 - 1],
+        [30 - 1, 30 - 0, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 - 0, 30 - 1],
+        [30 - 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 - 1],
+        [30 - 1, 30 + .5, 30 + 0, 30 + 0, 30 + 0, 30 + 0, 30 + .5, 30 - 1],
+        [30 - 2, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 2]
+    ],
+    "bB": [
+        [30 - 2, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 2],
+        [30 - 1, 30 + .5, 30 + 0, 30 + 0, 30 + 0, 30 + 0, 30 + .5, 30 - 1],
+        [30 + 2, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 + 2],
+        [30 - 1, 30 - 0, 30 + 1, 30 + 1, 30 + 1, 30 + 1, 30 - 0, 30 - 1],
+        [30 - 1, 30 + .5, 30 + .5, 30 + 1, 30 + 1, 30 + .5, 30 + .5, 30 - 1],
+        [30 - 1, 30 - 0, 30 + .5, 30 + 1, 30 + 1, 30 + .5, 30 - 0, 30 - 1],
+        [30 - 1, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 1],
+        [30 - 2, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 1, 30 - 2]
+    ],
+    "wN": [
+        [30 - 5, 30 - 4, 30 - 3, 30 - 3, 30 - 3, 30 - 3, 30 - 4, 30 - 5],
+        [30 - 4, 30 - 2, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 2, 30 - 4],
+        [30 - 3, 30 - 0, 30 + 1, 30 + 1.5, 30 + 1.5, 30 + 1, 30 + 0, 30 - 3],
+        [30 - 3, 30 + .5, 30 + 1.5, 30 + 2, 30 + 2, 30 + 1.5, 30 + .5, 30 - 3],
+        [30 - 3, 30 + 0, 30 + 1.5, 30 + 2, 30 + 2, 30 + 1.5, 30 + 0, 30 - 3],
+        [30 - 3, 30 + .5, 30 + 1, 30 + 1.5, 30 + 1.5, 30 + 1, 30 + .5, 30 - 3],
+        [30 - 4, 30 - 2, 30 - 0, 30 + .5, 30 + .5, 30 + 0, 30 - 2, 30 - 4],
+        [30 - 5, 30 - 4, 30 - 3, 30 - 3, 30 - 3, 30 - 3, 30 - 4, 30 - 5]
+    ],
+    "bN": [
+        [30 - 5, 30 - 4, 30 - 3, 30 - 3, 30 - 3, 30 - 3, 30 - 4, 30 - 5],
+        [30 - 4, 30 - 2, 30 - 0, 30 + .5, 30 + .5, 30 + 0, 30 - 2, 30 - 4],
+        [30 - 3, 30 + .5, 30 + 1, 30 + 1.5, 30 + 1.5, 30 + 1, 30 + .5, 30 - 3],
+        [30 - 3, 30 + 0, 30 + 1.5, 30 + 2, 30 + 2, 30 + 1.5, 30 + 0, 30 - 3],
+        [30 - 3, 30 + .5, 30 + 1.5, 30 + 2, 30 + 2, 30 + 1.5, 30 + .5, 30 - 3],
+        [30 - 3, 30 - 0, 30 + 1, 30 + 1.5, 30 + 1.5, 30 + 1, 30 + 0, 30 - 3],
+        [30 - 4, 30 - 2, 30 - 0, 30 - 0, 30 - 0, 30 - 0, 30 - 2, 30 - 4],
+        [30 - 5, 30 - 4, 30 - 3, 30 - 3, 30 - 3, 30 - 3, 30 - 4, 30 - 5]
+    ],
+    "wP": [
+        [10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0],
+        [10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5],
+        [10 + 1, 10 + 1, 10 + 2, 10 + 3, 10 + 3, 10 + 2, 10 + 1, 10 + 1],
+        [10 + .5, 10 + .5, 10 + 1, 10 + 2.5, 10 + 2.5, 10 + 1, 10 + .5, 10 + .5],
+        [10 - 0, 10 - 0, 10 - 0, 10 + 2, 10 + 2, 10 - 0, 10 - 0, 10 - 0],
+        [10 + .5, 10 - .5, 10 - 1, 10 - 0, 10 - 0, 10 - 1, 10 - .5, 10 + .5],
+        [10 - 1, 10 + .5, 10 - 0, 10 - 0, 10 - 0, 10 - 0, 10 + .5, 10 - 1],
+        [10 - 2, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 2]
+    ],
+    "bP": [
+        [10 - 2, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 1, 10 - 2],
+        [10 - 1, 10 + .5, 10 - 0, 10 - 0, 10 - 0, 10 - 0, 10 + .5, 10 - 1],
+        [10 + .5, 10 + 2, 10 - 1, 10 - 0, 10 - 0, 10 - 1, 10 + 2, 10 + .5],
+        [10 - 0, 10 - 0, 10 - 0, 10 + 2, 10 + 2, 10 - 0, 10 - 0, 10 - 0],
+        [10 + .5, 10 + .5, 10 + 1, 10 + 2.5, 10 + 2.5, 10 + 1, 10 + .5, 10 + .5],
+        [10 + 1, 10 + 1, 10 + 2, 10 + 3, 10 + 3, 10 + 2, 10 + 1, 10 + 1],
+        [10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5, 10 + 5],
+        [10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0, 10 + 0]
+    ],
+    "__": [
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0]
+    ]
+}
+
+
 class GameState():
     def __init__(self):
         self.board = [
@@ -32,18 +230,144 @@ class GameState():
         self.black_queen_side_castling = True
         self.black_king_side_castling = True
 
-        self.previous_valid_moves = []
-
         # [White Queen side, White King side, Black Queen side, Black King side]
         self.castle_rights_log = [[True, True, True, True]]
 
         self.enpassant_log = [()]
 
+        # Kept up to date so checks and pins can be found from the king outwards
+        self.white_king_location = (7, 4)
+        self.black_king_location = (0, 4)
+        self.pins = []
+        self.checks = []
+
+        self.zobrist_key = self.compute_zobrist_key()
+
+        # Material and positional score, positive when white is ahead
+        self.score = self.compute_score()
+        self.score_log = []
+
+        # Half moves since the last capture or pawn move, and the FEN move number
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.halfmove_clock_log = []
+
+    @classmethod
+    def from_fen(cls, fen):
+        game_state = cls()
+        game_state.load_fen(fen)
+        return game_state
+
+    # Replacing the current position with the one described by a FEN string.
+    # The move counter fields are optional
+    def load_fen(self, fen):
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError("FEN needs 4 or 6 fields: " + fen)
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError("FEN board needs 8 ranks: " + fen)
+
+        for row in range(8):
+            self.board[row] = []
+            for character in ranks[row]:
+                if character.isdigit():
+                    self.board[row].extend(["__"] * int(character))
+                elif character.upper() in "PNBRQK":
+                    color = "w" if character.isupper() else "b"
+                    self.board[row].append(color + character.upper())
+                    if character == "K":
+                        self.white_king_location = (row, len(self.board[row]) - 1)
+                    elif character == "k":
+                        self.black_king_location = (row, len(self.board[row]) - 1)
+                else:
+                    raise ValueError("Unknown piece in FEN: " + character)
+            if len(self.board[row]) != 8:
+                raise ValueError("FEN rank does not have 8 squares: " + ranks[row])
+
+        if fields[1] not in ("w", "b"):
+            raise ValueError("FEN side to move must be w or b: " + fields[1])
+        self.is_white_move = fields[1] == "w"
+
+        self.white_queen_side_castling = "Q" in fields[2]
+        self.white_king_side_castling = "K" in fields[2]
+        self.black_queen_side_castling = "q" in fields[2]
+        self.black_king_side_castling = "k" in fields[2]
+        self.castle_rights_log = [[self.white_queen_side_castling,
+                                   self.white_king_side_castling,
+                                   self.black_queen_side_castling,
+                                   self.black_king_side_castling]]
+
+        if fields[3] == "-":
+            self.enpassant_possible = ()
+        elif len(fields[3]) != 2 or fields[3][0] not in Move.files_to_columns or \
+                fields[3][1] != ("6" if self.is_white_move else "3"):
+            raise ValueError("Invalid enpassant square in FEN: " + fields[3])
+        else:
+            self.enpassant_possible = (Move.ranks_to_rows[fields[3][1]],
+                                       Move.files_to_columns[fields[3][0]])
+        self.enpassant_log = [self.enpassant_possible]
+
+        if len(fields) == 6:
+            self.halfmove_clock = int(fields[4])
+            self.fullmove_number = int(fields[5])
+        else:
+            self.halfmove_clock = 0
+            self.fullmove_number = 1
+
+        self.move_log = []
+        self.score_log = []
+        self.halfmove_clock_log = []
+        self.check_mate = False
+        self.stale_mate = False
+        self.zobrist_key = self.compute_zobrist_key()
+        self.score = self.compute_score()
+
+    def get_fen(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty_squares = 0
+            for piece in row:
+                if piece == "__":
+                    empty_squares += 1
+                    continue
+                if empty_squares:
+                    rank += str(empty_squares)
+                    empty_squares = 0
+                rank += piece[1] if piece[0] == "w" else piece[1].lower()
+            if empty_squares:
+                rank += str(empty_squares)
+            ranks.append(rank)
+
+        castling = ""
+        if self.white_king_side_castling:
+            castling += "K"
+        if self.white_queen_side_castling:
+            castling += "Q"
+        if self.black_king_side_castling:
+            castling += "k"
+        if self.black_queen_side_castling:
+            castling += "q"
+
+        if self.enpassant_possible:
+            enpassant = Move.columns_to_files[self.enpassant_possible[1]] + \
+                Move.rows_to_ranks[self.enpassant_possible[0]]
+        else:
+            enpassant = "-"
+
+        return " ".join(["/".join(ranks), "w" if self.is_white_move else "b",
+                         castling or "-", enpassant,
+                         str(self.halfmove_clock), str(self.fullmove_number)])
+
     def make_move(self, move):
+        self.update_zobrist_pieces(move)
+        self.score_log.append(self.score)
+        self.score += self.score_change(move)
         self.board[move.start_row][move.start_column] = "__"
         # Taking care of special moves specific cases
         if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_column] = move.piece_moved[0] + "Q"
+            self.board[move.end_row][move.end_column] = move.piece_moved[0] + move.promotion_piece
         elif move.is_enpassant_move:
             self.board[move.end_row][move.end_column] = move.piece_moved
             self.board[move.start_row][move.end_column] = "__"
@@ -59,22 +383,121 @@ class GameState():
             self.board[move.end_row][move.end_column] = move.piece_moved
 
         # Updating the enpassant_possible variable
+        if self.enpassant_possible:
+            self.zobrist_key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
         if move.piece_moved[1] == "P" and abs(move.start_row - move.end_row) == 2:
             self.enpassant_possible = (
                 (move.start_row + move.end_row) // 2, move.start_column)
+            self.zobrist_key ^= ZOBRIST_ENPASSANT[move.start_column]
         else:
             self.enpassant_possible = ()
 
         # Keeping a log of all moves being made
         self.move_log.append(move)
 
+        self.halfmove_clock_log.append(self.halfmove_clock)
+        if move.piece_moved[1] == "P" or move.piece_captured != "__":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if move.piece_moved[0] == "b":
+            self.fullmove_number += 1
+
+        if move.piece_moved == "wK":
+            self.white_king_location = (move.end_row, move.end_column)
+        elif move.piece_moved == "bK":
+            self.black_king_location = (move.end_row, move.end_column)
+
         # Updating castling rights
         self.update_castling_rights(move)
 
         # Switching move turns
         self.is_white_move = not self.is_white_move
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
         self.enpassant_log.append(self.enpassant_possible)
 
+        if DEBUG_INCREMENTAL:
+            assert self.zobrist_key == self.compute_zobrist_key()
+            assert self.score == self.compute_score()
+
+    # Toggling the keys of every piece a move touches. XOR is its own inverse,
+    # so the same update serves both make_move and undo_move
+    def update_zobrist_pieces(self, move):
+        key = self.zobrist_key
+        key ^= ZOBRIST_PIECES[move.piece_moved][move.start_row][move.start_column]
+        if move.is_enpassant_move:
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.start_row][move.end_column]
+        elif move.piece_captured != "__":
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.end_row][move.end_column]
+        if move.is_pawn_promotion:
+            key ^= ZOBRIST_PIECES[move.piece_moved[0] + move.promotion_piece][move.end_row][move.end_column]
+        else:
+            key ^= ZOBRIST_PIECES[move.piece_moved][move.end_row][move.end_column]
+        if move.is_castling_move:
+            rook_keys = ZOBRIST_PIECES[move.piece_moved[0] + "R"][move.end_row]
+            if move.end_column == 2:
+                key ^= rook_keys[0] ^ rook_keys[3]
+            else:
+                key ^= rook_keys[7] ^ rook_keys[5]
+        self.zobrist_key = key
+
+    def update_zobrist_castling(self, old_rights, new_rights):
+        for i in range(4):
+            if old_rights[i] != new_rights[i]:
+                self.zobrist_key ^= ZOBRIST_CASTLING[i]
+
+    # How much a move changes the score: the moved piece changes square (or
+    # promotes), the captured piece and a castling rook change too
+    def score_change(self, move):
+        start_row, start_column = move.start_row, move.start_column
+        end_row, end_column = move.end_row, move.end_column
+        if move.is_pawn_promotion:
+            change = piece_scores[move.piece_moved[0] + move.promotion_piece][end_row][end_column]
+        else:
+            change = piece_scores[move.piece_moved][end_row][end_column]
+        change -= piece_scores[move.piece_moved][start_row][start_column]
+        if move.is_enpassant_move:
+            change += piece_scores[move.piece_captured][start_row][end_column]
+        else:
+            change += piece_scores[move.piece_captured][end_row][end_column]
+        if move.is_castling_move:
+            rook_scores = piece_scores[move.piece_moved[0] + "R"][end_row]
+            if end_column == 2:
+                change += rook_scores[3] - rook_scores[0]
+            else:
+                change += rook_scores[5] - rook_scores[7]
+        return change if move.piece_moved[0] == "w" else -change
+
+    def compute_score(self):
+        score = 0
+        for row in range(8):
+            for column in range(8):
+                piece = self.board[row][column]
+                if piece[0] == "w":
+                    score += piece_scores[piece][row][column]
+                elif piece[0] == "b":
+                    score -= piece_scores[piece][row][column]
+        return score
+
+    # Hashing the whole position, used on setup and to verify the incremental key
+    def compute_zobrist_key(self):
+        key = 0
+        for row in range(8):
+            for column in range(8):
+                piece = self.board[row][column]
+                if piece != "__":
+                    key ^= ZOBRIST_PIECES[piece][row][column]
+        if not self.is_white_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        rights = [self.white_queen_side_castling, self.white_king_side_castling,
+                  self.black_queen_side_castling, self.black_king_side_castling]
+        for i in range(4):
+            if rights[i]:
+                key ^= ZOBRIST_CASTLING[i]
+        if self.enpassant_possible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        return key
+
     def update_castling_rights(self, move):
         if self.white_queen_side_castling or self.white_king_side_castling or \
            self.black_queen_side_castling or self.black_king_side_castling:
@@ -108,10 +531,12 @@ class GameState():
                 self.black_queen_side_castling,
                 self.black_king_side_castling]
 
+        self.update_zobrist_castling(self.castle_rights_log[-1], temp)
         self.castle_rights_log.append(temp)
 
     def undo_move(self):
         last_move = self.move_log.pop()
+        self.update_zobrist_pieces(last_move)
         self.board[last_move.start_row][last_move.start_column] = last_move.piece_moved
         # Undoing an enpassant move
         if last_move.is_enpassant_move:
@@ -132,9 +557,16 @@ class GameState():
         else:
             self.board[last_move.end_row][last_move.end_column] = last_move.piece_captured
         self.is_white_move = not self.is_white_move
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+
+        if last_move.piece_moved == "wK":
+            self.white_king_location = (last_move.start_row, last_move.start_column)
+        elif last_move.piece_moved == "bK":
+            self.black_king_location = (last_move.start_row, last_move.start_column)
 
         # Updating castling rights after every undone move
-        self.castle_rights_log.pop()
+        self.update_zobrist_castling(self.castle_rights_log.pop(),
+                                     self.castle_rights_log[-1])
         self.white_queen_side_castling = self.castle_rights_log[-1][0]
         self.white_king_side_castling = self.castle_rights_log[-1][1]
         self.black_queen_side_castling = self.castle_rights_log[-1][2]
@@ -144,54 +576,208 @@ class GameState():
         self.stale_mate = False
 
         self.enpassant_log.pop()
+        if self.enpassant_possible:
+            self.zobrist_key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
         self.enpassant_possible = self.enpassant_log[-1]
+        if self.enpassant_possible:
+            self.zobrist_key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
 
-    def get_valid_moves(self):
-        temp_enpassant_possible = self.enpassant_possible
+        self.score = self.score_log.pop()
 
-        temp_white_queen_castling = self.white_queen_side_castling
-        temp_white_king_castling = self.white_king_side_castling
-        temp_black_queen_side_castling = self.black_queen_side_castling
-        temp_black_king_side_castling = self.black_king_side_castling
+        self.halfmove_clock = self.halfmove_clock_log.pop()
+        if last_move.piece_moved[0] == "b":
+            self.fullmove_number -= 1
 
-        all_possible_moves = self.get_all_possible_moves()
-        all_valid_moves = []
+        if DEBUG_INCREMENTAL:
+            assert self.zobrist_key == self.compute_zobrist_key()
+            assert self.score == self.compute_score()
 
-        for move in all_possible_moves:
-            self.make_move(move)
-            opponent_moves = self.get_all_possible_moves()
-            if not self.is_check(opponent_moves):
-                all_valid_moves.append(move)
-            self.undo_move()
+    def get_valid_moves(self):
+        all_valid_moves, in_check = self.get_legal_moves()
 
         if all_valid_moves:
             self.stale_mate = False
             self.check_mate = False
+        elif in_check:
+            self.check_mate = True
         else:
-            self.is_white_move = not self.is_white_move
-            opponent_moves = self.get_all_possible_moves()
-            if self.is_check(opponent_moves):
-                self.is_white_move = not self.is_white_move
-                self.check_mate = True
-            else:
-                self.is_white_move = not self.is_white_move
-                self.stale_mate = True
-
-        self.white_queen_side_castling = temp_white_queen_castling
-        self.white_king_side_castling = temp_white_king_castling
-        self.black_king_side_castling = temp_black_king_side_castling
-        self.black_queen_side_castling = temp_black_queen_side_castling
+            self.stale_mate = True
 
-        self.enpassant_possible = temp_enpassant_possible
         return all_valid_moves
 
-    def is_check(self, moves):
-        for move in moves:
-            if move.piece_captured[1] == "K":
+    # Legal captures and queen promotions only, used by the quiescence search.
+    # Unlike get_valid_moves it leaves check_mate and stale_mate untouched
+    def get_capture_moves(self):
+        return self.get_legal_moves(captures_only=True)[0]
+
+    # Legal moves of the piece on one square, so that a single move such as a
+    # hash or killer move can be checked without generating all the others
+    def get_piece_moves(self, row, column):
+        in_check, self.pins, self.checks = self.check_for_pins_and_checks()
+        if in_check:
+            return [move for move in self.get_legal_moves()[0]
+                    if move.start_row == row and move.start_column == column]
+        moves = []
+        piece = self.board[row][column]
+        if piece[0] == ("w" if self.is_white_move else "b"):
+            self.piece_functions[piece[1]](row, column, moves)
+            if piece[1] == "K":
+                moves.extend(self.get_castling_moves())
+        return moves
+
+    # Returns the legal moves together with whether the side to move is in check
+    def get_legal_moves(self, captures_only=False):
+        in_check, self.pins, self.checks = self.check_for_pins_and_checks()
+        if self.is_white_move:
+            king_row, king_column = self.white_king_location
+        else:
+            king_row, king_column = self.black_king_location
+
+        if in_check:
+            if len(self.checks) == 1:
+                all_valid_moves = self.get_all_possible_moves(
+                    castling=False, captures_only=captures_only)
+                # Squares a non-king move may land on to block or capture the checker
+                check_row, check_column, direction_row, direction_column = self.checks[0]
+                valid_squares = []
+                if self.board[check_row][check_column][1] == "N":
+                    valid_squares = [(check_row, check_column)]
+                else:
+                    for i in range(1, 8):
+                        square = (king_row + direction_row * i,
+                                  king_column + direction_column * i)
+                        valid_squares.append(square)
+                        if square == (check_row, check_column):
+                            break
+                for i in range(len(all_valid_moves) - 1, -1, -1):
+                    move = all_valid_moves[i]
+                    if move.piece_moved[1] == "K":
+                        continue
+                    if move.is_enpassant_move and \
+                            (move.start_row, move.end_column) == (check_row, check_column):
+                        continue
+                    if (move.end_row, move.end_column) not in valid_squares:
+                        all_valid_moves.pop(i)
+            else:
+                # Double check, only the king can move
+                all_valid_moves = []
+                self.get_king_moves(king_row, king_column, all_valid_moves,
+                                    captures_only)
+        else:
+            all_valid_moves = self.get_all_possible_moves(
+                castling=not captures_only, captures_only=captures_only)
+
+        return all_valid_moves, in_check
+
+    # Walking outwards from the king to find pieces giving check and own pieces
+    # pinned to the king. Both are stored as (row, column, direction row, direction column)
+    def check_for_pins_and_checks(self):
+        pins = []
+        checks = []
+        in_check = False
+        if self.is_white_move:
+            enemy_color, ally_color = "b", "w"
+            start_row, start_column = self.white_king_location
+        else:
+            enemy_color, ally_color = "w", "b"
+            start_row, start_column = self.black_king_location
+
+        for j, ray in enumerate(RAYS[start_row][start_column]):
+            direction = DIRECTIONS[j]
+            possible_pin = ()
+            for i, (end_row, end_column) in enumerate(ray, 1):
+                end_piece = self.board[end_row][end_column]
+                # The own king is skipped so king moves can be tested in place
+                if end_piece[0] == ally_color and end_piece[1] != "K":
+                    if possible_pin == ():
+                        possible_pin = (end_row, end_column,
+                                        direction[0], direction[1])
+                    else:
+                        break
+                elif end_piece[0] == enemy_color:
+                    piece_type = end_piece[1]
+                    # First 4 directions are orthogonal, last 4 are diagonal
+                    if (0 <= j <= 3 and piece_type == "R") or \
+                            (4 <= j <= 7 and piece_type == "B") or \
+                            (i == 1 and piece_type == "P" and
+                             ((enemy_color == "w" and 6 <= j <= 7) or
+                              (enemy_color == "b" and 4 <= j <= 5))) or \
+                            piece_type == "Q" or (i == 1 and piece_type == "K"):
+                        if possible_pin == ():
+                            in_check = True
+                            checks.append((end_row, end_column,
+                                           direction[0], direction[1]))
+                        else:
+                            pins.append(possible_pin)
+                    break
+
+        for end_row, end_column in KNIGHT_TARGETS[start_row][start_column]:
+            if self.board[end_row][end_column] == enemy_color + "N":
+                in_check = True
+                checks.append((end_row, end_column,
+                               end_row - start_row, end_column - start_column))
+
+        return in_check, pins, checks
+
+    def get_pin_direction(self, row, column):
+        for pin in self.pins:
+            if pin[0] == row and pin[1] == column:
+                return (pin[2], pin[3])
+        return ()
+
+    # A pinned piece may only move along the line between the king and the pinner
+    def can_move_along(self, pin_direction, row_offset, column_offset):
+        return not pin_direction or \
+            pin_direction == (row_offset, column_offset) or \
+            pin_direction == (-row_offset, -column_offset)
+
+    # Looking outwards from the square with the attack tables, so no moves
+    # have to be generated to find out whether a square is covered
+    def is_square_attacked(self, row, column, by_color):
+        board = self.board
+        for attacker_row, attacker_column in PAWN_ATTACKERS[by_color][row][column]:
+            if board[attacker_row][attacker_column] == by_color + "P":
                 return True
+        for attacker_row, attacker_column in KNIGHT_TARGETS[row][column]:
+            if board[attacker_row][attacker_column] == by_color + "N":
+                return True
+        for attacker_row, attacker_column in KING_TARGETS[row][column]:
+            if board[attacker_row][attacker_column] == by_color + "K":
+                return True
+        queen = by_color + "Q"
+        for j, ray in enumerate(RAYS[row][column]):
+            # First 4 directions are orthogonal, last 4 are diagonal
+            slider = by_color + "R" if j <= 3 else by_color + "B"
+            for attacker_row, attacker_column in ray:
+                piece = board[attacker_row][attacker_column]
+                if piece != "__":
+                    if piece == slider or piece == queen:
+                        return True
+                    break
         return False
 
-    def get_all_possible_moves(self):
+    def in_check(self):
+        if self.is_white_move:
+            return self.is_square_attacked(*self.white_king_location, "b")
+        return self.is_square_attacked(*self.black_king_location, "w")
+
+    # Testing whether the side to move would be in check with its king on this
+    # square. The king is lifted off the board so it does not block an attack
+    # along the line it moves on
+    def is_king_square_safe(self, row, column):
+        if self.is_white_move:
+            king_row, king_column = self.white_king_location
+            enemy_color = "b"
+        else:
+            king_row, king_column = self.black_king_location
+            enemy_color = "w"
+        king = self.board[king_row][king_column]
+        self.board[king_row][king_column] = "__"
+        safe = not self.is_square_attacked(row, column, enemy_color)
+        self.board[king_row][king_column] = king
+        return safe
+
+    def get_all_possible_moves(self, castling=True, captures_only=False):
         moves = []
         for row in range(len(self.board)):
             for column in range(len(self.board[row])):
@@ -200,425 +786,158 @@ class GameState():
                     if (color == "w" and self.is_white_move) or \
                             (color == "b" and not self.is_white_move):
                         piece = self.board[row][column][1]
-                        self.piece_functions[piece](row, column, moves)
-        castling_moves = self.get_castling_moves()
-        for move in castling_moves:
-            moves.append(move)
+                        self.piece_functions[piece](
+                            row, column, moves, captures_only)
+        if castling:
+            moves.extend(self.get_castling_moves())
         return moves
 
-    def get_pawn_moves(self, row, column, moves):
+    def get_pawn_moves(self, row, column, moves, captures_only=False):
         piece_color = self.board[row][column][0]
+        pin_direction = self.get_pin_direction(row, column)
 
         if piece_color == "w":
-            # Captures to the left
-            if row > 0 and column - 1 >= 0 and \
-                    self.board[row - 1][column - 1][0] == "b":
-                move = Move((row, column),
-                            (row - 1, column - 1), self.board)
-                moves.append(move)
-            # Enpassant left capture
-            elif (row - 1, column - 1) == self.enpassant_possible:
-                move = Move((row, column), (row - 1, column - 1),
-                            self.board, is_enpassant_move=True)
-                moves.append(move)
-            # Captures to the right
-            if row > 0 and column + 1 <= 7 and \
-                    self.board[row - 1][column + 1][0] == "b":
-                move = Move((row, column),
-                            (row - 1, column + 1), self.board)
-                moves.append(move)
-            # Enpassant right capture
-            elif (row - 1, column + 1) == self.enpassant_possible:
-                move = Move((row, column), (row - 1, column + 1),
-                            self.board, is_enpassant_move=True)
-                moves.append(move)
-            # 1 space moving forward
-            if row > 0 and self.board[row - 1][column] == "__":
-                move = Move((row, column),
-                            (row - 1, column), self.board)
-                moves.append(move)
-                # 2 space moving forward
-                if row == 6 and self.board[row - 2][column] == "__":
-                    move = Move((row, column),
-                                (row - 2, column), self.board)
-                    moves.append(move)
-
-        elif piece_color == "b":
-            # Captures to the left
-            if row < 7 and column - 1 >= 0 and \
-                    self.board[row + 1][column - 1][0] == "w":
-                move = Move((row, column),
-                            (row + 1, column - 1), self.board)
-                moves.append(move)
-            # Enpassant left capture
-            elif (row + 1, column - 1) == self.enpassant_possible:
-                move = Move((row, column), (row + 1, column - 1),
-                            self.board, is_enpassant_move=True)
-                moves.append(move)
-            # Captures to the right
-            if row < 7 and column + 1 <= 7 and \
-                    self.board[row + 1][column + 1][0] == "w":
+            forward, start_row, enemy_color = -1, 6, "b"
+        else:
+            forward, start_row, enemy_color = 1, 1, "w"
+
+        # 1 space moving forward, which only counts as a capture move when promoting
+        if self.board[row + forward][column] == "__" and \
+                self.can_move_along(pin_direction, forward, 0) and \
+                (not captures_only or row + forward in (0, 7)):
+            self.add_pawn_move((row, column), (row + forward, column),
+                               moves, captures_only)
+            # 2 space moving forward
+            if row == start_row and not captures_only and \
+                    self.board[row + 2 * forward][column] == "__":
                 move = Move((row, column),
-                            (row + 1, column + 1), self.board)
-                moves.append(move)
-            # Enpassant right capture
-            elif (row + 1, column + 1) == self.enpassant_possible:
-                move = Move((row, column), (row + 1, column + 1),
+                            (row + 2 * forward, column), self.board)
+                moves.append(move)
+
+        # Captures to the left and right
+        for column_offset in (-1, 1):
+            end_column = column + column_offset
+            if not 0 <= end_column <= 7 or \
+                    not self.can_move_along(pin_direction, forward, column_offset):
+                continue
+            if self.board[row + forward][end_column][0] == enemy_color:
+                self.add_pawn_move((row, column), (row + forward, end_column),
+                                   moves, captures_only)
+            elif (row + forward, end_column) == self.enpassant_possible and \
+                    self.is_enpassant_safe(row, column, end_column, forward):
+                move = Move((row, column), (row + forward, end_column),
                             self.board, is_enpassant_move=True)
                 moves.append(move)
-            # 1 space moving forward
-            if row < 6 and self.board[row + 1][column] == "__":
-                move = Move((row, column),
-                            (row + 1, column), self.board)
-                moves.append(move)
-                # 2 space moving forward
-                if row == 1 and self.board[row + 2][column] == "__":
-                    move = Move((row, column),
-                                (row + 2, column), self.board)
-                    moves.append(move)
 
-    def get_rook_moves(self, row, column, moves):
-        piece_color = self.board[row][column][0]
-        opponent_color = "b" if piece_color == "w" else "w"
-
-        # Checking forward spaces
-        i = 1
-        while row - i >= 0:
-            if self.board[row - i][column][0] == opponent_color or \
-                    self.board[row - i][column][0] == "_":
-                move = Move((row, column), (row - i, column), self.board)
-                moves.append(move)
-            if self.board[row - i][column][0] == opponent_color or \
-                    self.board[row - i][column][0] == piece_color:
-                break
-            i += 1
-        # Checking backward spaces
-        i = 1
-        while row + i <= 7:
-            if self.board[row + i][column][0] == opponent_color or \
-                    self.board[row + i][column][0] == "_":
-                move = Move((row, column), (row + i, column), self.board)
-                moves.append(move)
-            if self.board[row + i][column][0] == opponent_color or \
-                    self.board[row + i][column][0] == piece_color:
-                break
-            i += 1
-        # Checking right-side spaces
-        i = 1
-        while column + i <= 7:
-            if self.board[row][column + i][0] == opponent_color or \
-                    self.board[row][column + i][0] == "_":
-                move = Move((row, column), (row, column + i), self.board)
+    # A pawn reaching the last row promotes to any piece, except when only
+    # captures are wanted where the queen is enough
+    def add_pawn_move(self, start_square, end_square, moves, captures_only):
+        if end_square[0] == 0 or end_square[0] == 7:
+            for promotion_piece in PROMOTION_PIECES[:1] if captures_only else PROMOTION_PIECES:
+                move = Move(start_square, end_square, self.board,
+                            promotion_piece=promotion_piece)
                 moves.append(move)
-            if self.board[row][column + i][0] == opponent_color or \
-                    self.board[row][column + i][0] == piece_color:
-                break
-            i += 1
-        # Checking left-side spaces
-        i = 1
-        while column - i >= 0:
-            if self.board[row][column - i][0] == opponent_color or \
-                    self.board[row][column - i][0] == "_":
-                move = Move((row, column), (row, column - i), self.board)
-                moves.append(move)
-            if self.board[row][column - i][0] == opponent_color or \
-                    self.board[row][column - i][0] == piece_color:
+        else:
+            moves.append(Move(start_square, end_square, self.board))
+
+    # Enpassant removes two pieces from the same row at once, which can expose
+    # the king to a rook or queen along that row, so it is tested directly
+    def is_enpassant_safe(self, row, column, end_column, forward):
+        pawn = self.board[row][column]
+        captured = self.board[row][end_column]
+        self.board[row][column] = "__"
+        self.board[row][end_column] = "__"
+        self.board[row + forward][end_column] = pawn
+        in_check = self.in_check()
+        self.board[row + forward][end_column] = "__"
+        self.board[row][end_column] = captured
+        self.board[row][column] = pawn
+        return not in_check
+
+    # Rook, bishop and queen moves, walking the precomputed rays of the square
+    # given by their indices
+    def get_sliding_moves(self, row, column, ray_indices, moves, captures_only=False):
+        board = self.board
+        piece_color = board[row][column][0]
+        pin_direction = self.get_pin_direction(row, column)
+        rays = RAYS[row][column]
+
+        for j in ray_indices:
+            if pin_direction and not self.can_move_along(pin_direction, *DIRECTIONS[j]):
+                continue
+            for end_row, end_column in rays[j]:
+                end_piece = board[end_row][end_column]
+                if end_piece == "__":
+                    if not captures_only:
+                        moves.append(Move((row, column), (end_row, end_column), board))
+                    continue
+                if end_piece[0] != piece_color:
+                    moves.append(Move((row, column), (end_row, end_column), board))
                 break
-            i += 1
 
-    def get_knight_moves(self, row, column, moves):
-        piece_color = self.board[row][column][0]
+    def get_rook_moves(self, row, column, moves, captures_only=False):
+        self.get_sliding_moves(row, column, ROOK_RAYS, moves, captures_only)
 
-        if row + 2 <= 7:
-            if column + 1 <= 7 and self.board[row + 2][column + 1][0] != piece_color:
-                move = Move((row, column), (row + 2, column + 1), self.board)
-                moves.append(move)
-            if column - 1 >= 0 and self.board[row + 2][column - 1][0] != piece_color:
-                move = Move((row, column), (row + 2, column - 1), self.board)
-                moves.append(move)
-        if row + 1 <= 7:
-            if column + 2 <= 7 and self.board[row + 1][column + 2][0] != piece_color:
-                move = Move((row, column), (row + 1, column + 2), self.board)
-                moves.append(move)
-            if column - 2 >= 0 and self.board[row + 1][column - 2][0] != piece_color:
-                move = Move((row, column), (row + 1, column - 2), self.board)
-                moves.append(move)
-        if row - 1 >= 0:
-            if column + 2 <= 7 and self.board[row - 1][column + 2][0] != piece_color:
-                move = Move((row, column), (row - 1, column + 2), self.board)
-                moves.append(move)
-            if column - 2 >= 0 and self.board[row - 1][column - 2][0] != piece_color:
-                move = Move((row, column), (row - 1, column - 2), self.board)
-                moves.append(move)
-        if row - 2 >= 0:
-            if column + 1 <= 7 and self.board[row - 2][column + 1][0] != piece_color:
-                move = Move((row, column), (row - 2, column + 1), self.board)
-                moves.append(move)
-            if column - 1 >= 0 and self.board[row - 2][column - 1][0] != piece_color:
-                move = Move((row, column), (row - 2, column - 1), self.board)
-                moves.append(move)
+    def get_bishop_moves(self, row, column, moves, captures_only=False):
+        self.get_sliding_moves(row, column, BISHOP_RAYS, moves, captures_only)
 
-    def get_bishop_moves(self, row, column, moves):
-        piece_color = self.board[row][column][0]
-        opponent_color = "b" if piece_color == "w" else "w"
-
-        # Checking for Top-Left spaces
-        i = 1
-        while row - i >= 0 and column - i >= 0:
-            if self.board[row - i][column - i][0] == opponent_color or \
-                    self.board[row - i][column - i][0] == "_":
-                move = Move((row, column),
-                            (row - i, column - i), self.board)
-                moves.append(move)
-            if self.board[row - i][column - i][0] == opponent_color or \
-                    self.board[row - i][column - i][0] == piece_color:
-                break
-            i += 1
-        # Checking for Top-Right spaces
-        i = 1
-        while row - i >= 0 and column + i <= 7:
-            if self.board[row - i][column + i][0] == opponent_color or \
-                    self.board[row - i][column + i][0] == "_":
-                move = Move((row, column),
-                            (row - i, column + i), self.board)
-                moves.append(move)
-            if self.board[row - i][column + i][0] == opponent_color or \
-                    self.board[row - i][column + i][0] == piece_color:
-                break
-            i += 1
-        # Checking for Bottom-Left spaces
-        i = 1
-        while row + i <= 7 and column - i >= 0:
-            if self.board[row + i][column - i][0] == opponent_color or \
-                    self.board[row + i][column - i][0] == "_":
-                move = Move((row, column),
-                            (row + i, column - i), self.board)
-                moves.append(move)
-            if self.board[row + i][column - i][0] == opponent_color or \
-                    self.board[row + i][column - i][0] == piece_color:
-                break
-            i += 1
-        # Checking for Bottom-Right spaces
-        i = 1
-        while row + i <= 7 and column + i <= 7:
-            if self.board[row + i][column + i][0] == opponent_color or \
-                    self.board[row + i][column + i][0] == "_":
-                move = Move((row, column),
-                            (row + i, column + i), self.board)
-                moves.append(move)
-            if self.board[row + i][column + i][0] == opponent_color or \
-                    self.board[row + i][column + i][0] == piece_color:
-                break
-            i += 1
+    def get_queen_moves(self, row, column, moves, captures_only=False):
+        self.get_sliding_moves(row, column, QUEEN_RAYS, moves, captures_only)
 
-    def get_queen_moves(self, row, column, moves):
+    def get_knight_moves(self, row, column, moves, captures_only=False):
+        # A pinned knight can never stay on the pin line
+        if self.get_pin_direction(row, column):
+            return
         piece_color = self.board[row][column][0]
-        opponent_color = "b" if piece_color == "w" else "w"
+        # Skipping empty squares as well when only captures are wanted
+        excluded = ("_", piece_color) if captures_only else (piece_color,)
 
-        # Checking for Top-Left spaces
-        i = 1
-        while row - i >= 0 and column - i >= 0:
-            if self.board[row - i][column - i][0] == opponent_color or \
-                    self.board[row - i][column - i][0] == "_":
-                move = Move((row, column),
-                            (row - i, column - i), self.board)
+        for end_row, end_column in KNIGHT_TARGETS[row][column]:
+            if self.board[end_row][end_column][0] not in excluded:
+                move = Move((row, column), (end_row, end_column), self.board)
                 moves.append(move)
-            if self.board[row - i][column - i][0] == opponent_color or \
-                    self.board[row - i][column - i][0] == piece_color:
-                break
-            i += 1
-        # Checking for Top-Right spaces
-        i = 1
-        while row - i >= 0 and column + i <= 7:
-            if self.board[row - i][column + i][0] == opponent_color or \
-                    self.board[row - i][column + i][0] == "_":
-                move = Move((row, column),
-                            (row - i, column + i), self.board)
-                moves.append(move)
-            if self.board[row - i][column + i][0] == opponent_color or \
-                    self.board[row - i][column + i][0] == piece_color:
-                break
-            i += 1
-        # Checking for Bottom-Left spaces
-        i = 1
-        while row + i <= 7 and column - i >= 0:
-            if self.board[row + i][column - i][0] == opponent_color or \
-                    self.board[row + i][column - i][0] == "_":
-                move = Move((row, column),
-                            (row + i, column - i), self.board)
-                moves.append(move)
-            if self.board[row + i][column - i][0] == opponent_color or \
-                    self.board[row + i][column - i][0] == piece_color:
-                break
-            i += 1
-        # Checking for Bottom-Right spaces
-        i = 1
-        while row + i <= 7 and column + i <= 7:
-            if self.board[row + i][column + i][0] == opponent_color or \
-                    self.board[row + i][column + i][0] == "_":
-                move = Move((row, column),
-                            (row + i, column + i), self.board)
-                moves.append(move)
-            if self.board[row + i][column + i][0] == opponent_color or \
-                    self.board[row + i][column + i][0] == piece_color:
-                break
-            i += 1
-        # Checking forward spaces
-        i = 1
-        while row - i >= 0:
-            if self.board[row - i][column][0] == opponent_color or \
-                    self.board[row - i][column][0] == "_":
-                move = Move((row, column), (row - i, column), self.board)
-                moves.append(move)
-            if self.board[row - i][column][0] == opponent_color or \
-                    self.board[row - i][column][0] == piece_color:
-                break
-            i += 1
-        # Checking backward spaces
-        i = 1
-        while row + i <= 7:
-            if self.board[row + i][column][0] == opponent_color or \
-                    self.board[row + i][column][0] == "_":
-                move = Move((row, column), (row + i, column), self.board)
-                moves.append(move)
-            if self.board[row + i][column][0] == opponent_color or \
-                    self.board[row + i][column][0] == piece_color:
-                break
-            i += 1
-        # Checking right-side spaces
-        i = 1
-        while column + i <= 7:
-            if self.board[row][column + i][0] == opponent_color or \
-                    self.board[row][column + i][0] == "_":
-                move = Move((row, column), (row, column + i), self.board)
-                moves.append(move)
-            if self.board[row][column + i][0] == opponent_color or \
-                    self.board[row][column + i][0] == piece_color:
-                break
-            i += 1
-        # Checking left-side spaces
-        i = 1
-        while column - i >= 0:
-            if self.board[row][column - i][0] == opponent_color or \
-                    self.board[row][column - i][0] == "_":
-                move = Move((row, column), (row, column - i), self.board)
-                moves.append(move)
-            if self.board[row][column - i][0] == opponent_color or \
-                    self.board[row][column - i][0] == piece_color:
-                break
-            i += 1
 
-    def get_king_moves(self, row, column, moves):
+    def get_king_moves(self, row, column, moves, captures_only=False):
         piece_color = self.board[row][column][0]
+        excluded = ("_", piece_color) if captures_only else (piece_color,)
 
-        # Checking forward spaces
-        if row - 1 >= 0:
-            if self.board[row - 1][column][0] != piece_color:
-                move = Move((row, column), (row - 1, column), self.board)
-                moves.append(move)
-            if column - 1 >= 0 and self.board[row - 1][column - 1][0] != piece_color:
-                move = Move((row, column),
-                            (row - 1, column - 1), self.board)
-                moves.append(move)
-            if column + 1 <= 7 and self.board[row - 1][column + 1][0] != piece_color:
-                move = Move((row, column),
-                            (row - 1, column + 1), self.board)
-                moves.append(move)
-        # Checking sideways spaces
-        if column - 1 >= 0 and self.board[row][column - 1][0] != piece_color:
-            move = Move((row, column), (row, column - 1), self.board)
-            moves.append(move)
-        if column + 1 <= 7 and self.board[row][column + 1][0] != piece_color:
-            move = Move((row, column), (row, column + 1), self.board)
-            moves.append(move)
-        # Checking for downward spaces
-        if row + 1 <= 7:
-            if self.board[row + 1][column][0] != piece_color:
-                move = Move((row, column), (row + 1, column), self.board)
-                moves.append(move)
-            if column - 1 >= 0 and self.board[row + 1][column - 1][0] != piece_color:
-                move = Move((row, column),
-                            (row + 1, column - 1), self.board)
-                moves.append(move)
-            if column + 1 <= 7 and self.board[row + 1][column + 1][0] != piece_color:
-                move = Move((row, column),
-                            (row + 1, column + 1), self.board)
+        for end_row, end_column in KING_TARGETS[row][column]:
+            if self.board[end_row][end_column][0] not in excluded and \
+                    self.is_king_square_safe(end_row, end_column):
+                move = Move((row, column), (end_row, end_column), self.board)
                 moves.append(move)
 
+    # Castling out of check is ruled out by the caller. The rook has to be in
+    # its corner with the squares between it and the king empty, and the king
+    # may not cross or land on an attacked square
     def get_castling_moves(self):
         moves = []
         if self.is_white_move:
+            row, enemy_color, rook = 7, "b", "wR"
             queen_side, king_side = self.white_queen_side_castling, self.white_king_side_castling
-            if queen_side or king_side:
-                for opponent_move in self.previous_valid_moves:
-                    # Checking if king is on check
-                    if opponent_move.piece_captured[1] == "K":
-                        queen_side = king_side = False
-                    # Checking if squares on queen size are in check
-                    elif (opponent_move.end_row == 7 and
-                          (opponent_move.end_column == 2 or opponent_move.end_column == 3)):
-                        queen_side = False
-                    # Checking if squares on king size are in check
-                    elif (opponent_move.end_row == 7 and
-                          (opponent_move.end_column == 5 or opponent_move.end_column == 6)):
-                        king_side = False
-                if queen_side:
-                    # Checking if sqaures on queen side are empty
-                    for column in range(1, 4):
-                        if self.board[7][column] != "__":
-                            queen_side = False
-                    if queen_side:
-                        move = Move((7, 4), (7, 2), self.board,
-                                    is_castling_move=True)
-                        moves.append(move)
-                if king_side:
-                    # Checking if sqaures on king side are empty
-                    for column in range(5, 7):
-                        if self.board[7][column] != "__":
-                            king_side = False
-                    if king_side:
-                        move = Move((7, 4), (7, 6), self.board,
-                                    is_castling_move=True)
-                        moves.append(move)
-
         else:
+            row, enemy_color, rook = 0, "w", "bR"
             queen_side, king_side = self.black_queen_side_castling, self.black_king_side_castling
-            if queen_side or king_side:
-                for opponent_move in self.previous_valid_moves:
-                    # Checking if king is on check
-                    if opponent_move.piece_captured[1] == "K":
-                        queen_side = king_side = False
-                    # Checking if squares on queen size are in check
-                    elif (opponent_move.end_row == 0 and
-                          (opponent_move.end_column == 2 or opponent_move.end_column == 3)):
-                        queen_side = False
-                    # Checking if squares on king size are in check
-                    elif (opponent_move.end_row == 0 and
-                          (opponent_move.end_column == 5 or opponent_move.end_column == 6)):
-                        king_side = False
-                if queen_side:
-                    # Checking if sqaures on queen side are empty
-                    for column in range(1, 4):
-                        if self.board[0][column] != "__":
-                            queen_side = False
-                    if queen_side:
-                        move = Move((0, 4), (0, 2), self.board,
-                                    is_castling_move=True)
-                        moves.append(move)
-                if king_side:
-                    # Checking if sqaures on king side are empty
-                    for column in range(5, 7):
-                        if self.board[0][column] != "__":
-                            king_side = False
-                    if king_side:
-                        move = Move((0, 4), (0, 6), self.board,
-                                    is_castling_move=True)
-                        moves.append(move)
 
+        if queen_side and self.board[row][0] == rook and \
+                all(self.board[row][column] == "__" for column in range(1, 4)) and \
+                not self.is_square_attacked(row, 3, enemy_color) and \
+                not self.is_square_attacked(row, 2, enemy_color):
+            moves.append(Move((row, 4), (row, 2), self.board, is_castling_move=True))
+        if king_side and self.board[row][7] == rook and \
+                all(self.board[row][column] == "__" for column in range(5, 7)) and \
+                not self.is_square_attacked(row, 5, enemy_color) and \
+                not self.is_square_attacked(row, 6, enemy_color):
+            moves.append(Move((row, 4), (row, 6), self.board, is_castling_move=True))
         return moves
 
 
 class Move():
+    # No per-instance __dict__, millions of moves are created during a search
+    __slots__ = ("start_row", "start_column", "end_row", "end_column",
+                 "piece_moved", "piece_captured", "is_enpassant_move",
+                 "is_castling_move", "promotion_piece", "is_pawn_promotion",
+                 "move_id")
 
     ranks_to_rows = {"1": 7, "2": 6, "3": 5, "4": 4,
                                      "5": 3, "6": 2, "7": 1, "8": 0}
@@ -628,39 +947,54 @@ class Move():
                         "e": 4, "f": 5, "g": 6, "h": 7}
     columns_to_files = {value: key for key, value in files_to_columns.items()}
 
-    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castling_move=False):
-        self.start_row = start_square[0]
-        self.start_column = start_square[1]
+    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castling_move=False,
+                 promotion_piece="Q"):
+        start_row, start_column = start_square
+        end_row, end_column = end_square
+        self.start_row = start_row
+        self.start_column = start_column
 
-        self.end_row = end_square[0]
-        self.end_column = end_square[1]
+        self.end_row = end_row
+        self.end_column = end_column
 
-        self.piece_moved = board[self.start_row][self.start_column]
-        self.piece_captured = board[self.end_row][self.end_column]
+        piece_moved = board[start_row][start_column]
+        self.piece_moved = piece_moved
+        self.piece_captured = board[end_row][end_column]
 
         self.is_enpassant_move = is_enpassant_move
 
         self.is_castling_move = is_castling_move
 
-        if self.is_enpassant_move:
-            self.piece_captured = "wP" if self.piece_moved == "bP" else "bP"
+        # Piece type a pawn turns into if this move promotes it
+        self.promotion_piece = promotion_piece
+        self.is_pawn_promotion = piece_moved[1] == "P" and (end_row == 0 or end_row == 7)
+
+        if is_enpassant_move:
+            self.piece_captured = "wP" if piece_moved == "bP" else "bP"
+
+        # Start square, end square and promotion piece packed into one int:
+        # bits 0-5 start, 6-11 end, 12-14 promotion (0 when not promoting).
+        # Enough to tell apart any two legal moves of a position
+        move_id = start_row << 3 | start_column | (end_row << 3 | end_column) << 6
+        if self.is_pawn_promotion:
+            move_id |= (PROMOTION_PIECES.index(promotion_piece) + 1) << 12
+        self.move_id = move_id
 
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.get_chess_notation == other.get_chess_notation
+            return self.move_id == other.move_id
         return False
 
+    def __hash__(self):
+        return self.move_id
+
     @property
     def get_chess_notation(self):
-        return self.get_rank_file(self.start_row, self.start_column) + \
+        notation = self.get_rank_file(self.start_row, self.start_column) + \
             self.get_rank_file(self.end_row, self.end_column)
+        if self.is_pawn_promotion:
+            notation += self.promotion_piece.lower()
+        return notation
 
     def get_rank_file(self, row, column):
         return self.columns_to_files[column] + self.rows_to_ranks[row]
-
-    @property
-    def is_pawn_promotion(self):
-        if self.piece_moved == "wP" and self.end_row == 0:
-            return True
-        elif self.piece_moved == "bP" and self.end_row == 7:
-            return True
@@ -1,6 +1,7 @@
+import multiprocessing
+import os
 import pygame
-import engine
-import AI
+from . import AI, engine
 
 # Initializing global variables
 WIDTH = HEIGHT = 512
@@ -8,18 +9,36 @@ DIMENSION = 8
 SQUARE_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15
 IMAGES = {}
+IMAGE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+COLORS = [pygame.Color("white"), pygame.Color("grey")]
+# The empty board and the translucent squares used for highlighting, drawn
+# once by load_surfaces instead of every frame
+BOARD_SURFACE = None
+HIGHLIGHTS = {}
+
+# Loading a piece image the first time it is drawn, IMAGES is a dictionary
+# with key == piece identifier and value == the scaled image
+def get_image(piece):
+    if piece not in IMAGES:
+        IMAGES[piece] = pygame.transform.scale(pygame.image.load(
+            os.path.join(IMAGE_DIRECTORY, piece + ".png")), (SQUARE_SIZE, SQUARE_SIZE)).convert_alpha()
+    return IMAGES[piece]
 
-# Loading images as a dictionary with key == piece identifier and \
-# value == directiory to the image file in folder
 
+def load_surfaces():
+    global BOARD_SURFACE
+    BOARD_SURFACE = pygame.Surface((WIDTH, HEIGHT)).convert()
+    # Dimensions = 8x8 which is the number of sqaures present in chess board
+    for row in range(DIMENSION):
+        for column in range(DIMENSION):
+            pygame.draw.rect(BOARD_SURFACE, COLORS[(row + column) % 2], pygame.Rect(
+                column*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
 
-def load_images():
-    pieces = ["wR", "wN", "wB", "wQ", "wK", "wP",
-              "bR", "bN", "bB", "bQ", "bK", "bP"]
-
-    for piece in pieces:
-        IMAGES[piece] = pygame.transform.scale(pygame.image.load(
-            "ChessEngine/images/" + piece + ".png"), (SQUARE_SIZE, SQUARE_SIZE))
+    for color in ["blue", "red", "yellow"]:
+        surface = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE)).convert()
+        surface.set_alpha(100)
+        surface.fill(pygame.Color(color))
+        HIGHLIGHTS[color] = surface
 
 
 def main():
@@ -32,7 +51,11 @@ def main():
     # game state keeps track of pieces positions on board
     game_state = engine.GameState()
 
-    load_images()
+    load_surfaces()
+    screen.blit(BOARD_SURFACE, (0, 0))
+    pygame.display.flip()
+    # What each square showed last frame, only squares that differ get redrawn
+    drawn_squares = [None] * (DIMENSION * DIMENSION)
 
     running = True
     initial_square_selected = ()
@@ -46,17 +69,30 @@ def main():
     is_white_human = True
     is_black_human = False
 
+    # The AI searches in a separate process so the window keeps responding.
+    # The process stays for the whole session, keeping what its search
+    # learned between moves. Changing search_id cancels the running search
+    AI_thinking = False
+    request_queue = multiprocessing.Queue()
+    return_queue = multiprocessing.Queue()
+    search_id = multiprocessing.Value("i", 0)
+    search_process = multiprocessing.Process(
+        target=AI.search_worker, args=(request_queue, return_queue, search_id),
+        daemon=True)
+    search_process.start()
+
     while running:
         is_human_turn = (game_state.is_white_move and is_white_human) or (
             not game_state.is_white_move and is_black_human)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+                search_id.value += 1
 
             # Evaluating which square(s) was/were being clicked on when \
             # making a move
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                if not game_over:
+                if not game_over and is_human_turn:
                     location = pygame.mouse.get_pos()
                     column = location[0] // SQUARE_SIZE
                     row = location[1] // SQUARE_SIZE
@@ -73,27 +109,12 @@ def main():
                     if len(squares_clicked) == 2:
                         move = engine.Move(
                             squares_clicked[0], squares_clicked[1], game_state.board)
-                        # Checking if move is valid, otherwise ignore it
+                        # Checking if move is valid, otherwise ignore it. The
+                        # generated move is played, it knows whether it is an
+                        # enpassant, castling or promotion move
                         for valid_move in valid_moves:
-                            if move == valid_move and valid_move.is_enpassant_move:
-                                move.is_enpassant_move = True
-                                game_state.make_move(move)
-                                move_made = True
-                                animate = True
-                                break
-                            if move.is_pawn_promotion and move == valid_move:
-                                game_state.make_move(move)
-                                move_made = True
-                                animate = True
-                                break
-                            if valid_move.is_castling_move and move == valid_move:
-                                move.is_castling_move = True
-                                game_state.make_move(move)
-                                move_made = True
-                                animate = True
-                                break
-                            elif move == valid_move:
-                                game_state.make_move(move)
+                            if move == valid_move:
+                                game_state.make_move(valid_move)
                                 move_made = True
                                 animate = True
                                 break
@@ -103,13 +124,23 @@ def main():
             elif event.type == pygame.KEYDOWN:
                 # Press key "z" to undo
                 if event.key == pygame.K_z and len(game_state.move_log):
-                    game_state.undo_move()
+                    # While the AI is thinking only the human's last move is
+                    # taken back, otherwise the AI's reply to it as well
+                    if AI_thinking:
+                        search_id.value += 1
+                        AI_thinking = False
+                    elif len(game_state.move_log) > 1:
+                        game_state.undo_move()
                     game_state.undo_move()
                     move_made = True
                     game_over = False
+                    drawn_squares = [None] * (DIMENSION * DIMENSION)
 
                 # Press key "r" to reset the game
                 if event.key == pygame.K_r:
+                    search_id.value += 1
+                    AI_thinking = False
+                    request_queue.put(("new_game",))
                     game_state = engine.GameState()
                     valid_moves = game_state.get_valid_moves()
                     move_made = False
@@ -117,148 +148,142 @@ def main():
                     initial_square_selected = ()
                     squares_clicked = []
                     game_over = False
+                    drawn_squares = [None] * (DIMENSION * DIMENSION)
 
-            elif not game_over and not is_human_turn:
-                AI_move = AI.find_best_move(game_state, valid_moves)
-                if not AI_move:
-                    AI_move = AI.random_move(valid_moves)
-                game_state.make_move(AI_move)
-                move_made = True
-                animate = True
-                is_human_turn = True
-
-            # Once a valid move has been made, get new valid moves \
-            # w.r.t the new game state(pieces positioning)
-            if move_made:
-                if animate:
-                    animate_move(
-                        game_state.move_log[-1], screen, game_state.board, clock)
-                animate = False
-
-                if (game_state.is_white_move and (game_state.white_queen_side_castling or game_state.white_king_side_castling)) or \
-                        (not game_state.is_white_move and (game_state.black_king_side_castling or game_state.black_queen_side_castling)):
-                    # Storing so it doesnt get altered when finding valid_moves
-                    temp = game_state.enpassant_possible
-                    game_state.enpassant_possible = ()
-
-                    # Getting previous_valid_moves to check castling rights
-                    game_state.is_white_move = not game_state.is_white_move
-                    game_state.previous_valid_moves = game_state.get_valid_moves()
-                    game_state.is_white_move = not game_state.is_white_move
-
-                    # Getting it back to its original value
-                    game_state.enpassant_possible = temp
-
-                valid_moves = game_state.get_valid_moves()
-                move_made = False
+        # Starting the search on the AI's turn, then checking once a frame
+        # whether it has finished. Whose turn it is is looked at again, a
+        # move or an undo above may have changed it
+        is_human_turn = (game_state.is_white_move and is_white_human) or (
+            not game_state.is_white_move and is_black_human)
+        if not game_over and not is_human_turn:
+            if not AI_thinking:
+                AI_thinking = True
+                search_id.value += 1
+                request_queue.put(("search", search_id.value, game_state))
+            elif not return_queue.empty():
+                result_search_id, move_id = return_queue.get()
+                # Answers to cancelled searches are dropped
+                if result_search_id == search_id.value:
+                    for valid_move in valid_moves:
+                        if valid_move.move_id == move_id:
+                            game_state.make_move(valid_move)
+                            break
+                    AI_thinking = False
+                    move_made = True
+                    animate = True
+
+        # Once a valid move has been made, get new valid moves \
+        # w.r.t the new game state(pieces positioning)
+        if move_made:
+            if animate:
+                animate_move(
+                    game_state.move_log[-1], screen, game_state.board, clock)
+            animate = False
+
+            valid_moves = game_state.get_valid_moves()
+            move_made = False
 
         # Visualizing the current game state of chee board
-        draw_chess_board(screen, game_state, valid_moves,
-                         initial_square_selected)
+        dirty_rects = draw_chess_board(screen, game_state, valid_moves,
+                                       initial_square_selected, drawn_squares)
 
-        if game_state.stale_mate:
+        # The text is drawn once, nothing on the board changes after it
+        if not game_over and game_state.stale_mate:
             game_over = True
             text = "Stalemate"
             draw_text(screen, text)
-        elif game_state.check_mate:
+        elif not game_over and game_state.check_mate:
             game_over = True
             team_won = "White" if not game_state.is_white_move else "Black"
             text = team_won + " wins by Checkmate"
             draw_text(screen, text)
 
         clock.tick(MAX_FPS)
-        pygame.display.flip()
-
-
-# Handles all graphics within the game
-def draw_chess_board(screen, game_state, valid_moves, square_selected):
-    draw_squares(screen)
-    highlight_square(screen, game_state, valid_moves, square_selected)
-    draw_pieces(screen, game_state.board)
-
-
-# Draw squares on the board
-def draw_squares(screen):
-    global colors
-    colors = {"white": pygame.Color(
-        "white"), "grey": pygame.Color("grey")}
+        pygame.display.update(dirty_rects)
 
-    # Dimensions = 8x8 which is the number of sqaures present in chess board
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            if (row + column) % 2 == 0:
-                pygame.draw.rect(screen, colors["white"], pygame.Rect(
-                    column*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-            else:
-                pygame.draw.rect(screen, colors["grey"], pygame.Rect(
-                    column*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+    request_queue.put(("quit",))
+    search_process.join(1)
+    if search_process.is_alive():
+        search_process.terminate()
 
 
-# Drawing the pieces over them squares on screen
-def draw_pieces(screen, board):
+# Handles all graphics within the game. Only squares whose piece or highlight
+# changed since the last frame are redrawn, their rects are returned for
+# pygame.display.update
+def draw_chess_board(screen, game_state, valid_moves, square_selected, drawn_squares):
+    highlights = get_highlights(game_state, valid_moves, square_selected)
+    dirty_rects = []
     for row in range(DIMENSION):
         for column in range(DIMENSION):
-            piece = board[row][column]
-            if piece != "__":
-                # IMAGES id the dictionary containing all the images
-                screen.blit(IMAGES[piece],  pygame.Rect(
-                    column*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-
-
-# Highlight square selected and the valid squares where the move can be made
-def highlight_square(screen, game_state, valid_moves, square_selected):
+            square = (game_state.board[row][column], highlights.get((row, column)))
+            if drawn_squares[row * DIMENSION + column] != square:
+                drawn_squares[row * DIMENSION + column] = square
+                dirty_rects.append(draw_square(screen, row, column, *square))
+    return dirty_rects
+
+
+def draw_square(screen, row, column, piece, highlight=None):
+    rect = pygame.Rect(column*SQUARE_SIZE, row*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+    screen.blit(BOARD_SURFACE, rect, rect)
+    if highlight:
+        screen.blit(HIGHLIGHTS[highlight], rect)
+    if piece != "__":
+        screen.blit(get_image(piece), rect)
+    return rect
+
+
+# Highlight square selected and the valid squares where the move can be made,
+# as a dictionary of square to highlight color
+def get_highlights(game_state, valid_moves, square_selected):
+    highlights = {}
     if square_selected:
         row, column = square_selected
         if (game_state.board[row][column][0] == "w" and game_state.is_white_move) or \
                 (game_state.board[row][column][0] == "b" and not game_state.is_white_move):
             # Highlighting the square selected = Blue
-            surface = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            surface.set_alpha(100)
-            surface.fill(pygame.Color('blue'))
-            screen.blit(surface, (column * SQUARE_SIZE, row * SQUARE_SIZE))
+            highlights[(row, column)] = "blue"
             # Higlighting the possible moves squares
             for move in valid_moves:
                 if move.start_row == row and move.start_column == column:
                     # Highlighting the sqaure if the move captures opponents piece
                     if move.piece_captured != "__":
-                        surface.fill(pygame.Color('red'))
-                        screen.blit(surface, (move.end_column *
-                                              SQUARE_SIZE, move.end_row * SQUARE_SIZE))
+                        highlights[(move.end_row, move.end_column)] = "red"
                     else:
                         # Otheriwse, if it is a neutral move, highlight it as yellow
-                        surface.fill(pygame.Color('yellow'))
-                        screen.blit(surface, (move.end_column *
-                                              SQUARE_SIZE, move.end_row * SQUARE_SIZE))
+                        highlights[(move.end_row, move.end_column)] = "yellow"
+    return highlights
 
 
-# Animating the move motion of the piece
+# Animating the move motion of the piece. Only the rectangle between the start
+# and end squares changes, so only that is redrawn and updated
 def animate_move(move, screen, board, clock):
-    colors = [pygame.Color("white"), pygame.Color("grey")]
-
     delta_row = move.end_row - move.start_row
     delta_column = move.end_column - move.start_column
 
     frames_per_square = 10
     total_frames = frames_per_square * (abs(delta_row) + abs(delta_column))
 
+    top, left = min(move.start_row, move.end_row), min(move.start_column, move.end_column)
+    bottom, right = max(move.start_row, move.end_row), max(move.start_column, move.end_column)
+    area = pygame.Rect(left * SQUARE_SIZE, top * SQUARE_SIZE,
+                       (right - left + 1) * SQUARE_SIZE, (bottom - top + 1) * SQUARE_SIZE)
+
     for frame in range(total_frames + 1):
         row, column = (move.start_row + (delta_row * frame / total_frames),
                        move.start_column + (delta_column * frame / total_frames))
 
-        draw_squares(screen)
-        draw_pieces(screen, board)
-
-        color = colors[(move.end_row + move.end_column) % 2]
-        end_square = pygame.Rect(move.end_column * SQUARE_SIZE,
-                                 move.end_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        pygame.draw.rect(screen, color, end_square)
-
-        if move.piece_captured != "__":
-            screen.blit(IMAGES[move.piece_captured], end_square)
+        for square_row in range(top, bottom + 1):
+            for square_column in range(left, right + 1):
+                piece = board[square_row][square_column]
+                # The moved piece is already on the end square, show what
+                # was there before until it arrives
+                if (square_row, square_column) == (move.end_row, move.end_column):
+                    piece = move.piece_captured
+                draw_square(screen, square_row, square_column, piece)
 
-        screen.blit(IMAGES[move.piece_moved], pygame.Rect(
+        screen.blit(get_image(move.piece_moved), pygame.Rect(
             column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        pygame.display.flip()
+        pygame.display.update(area)
         clock.tick(60)
 
 
@@ -0,0 +1,99 @@
+import argparse
+import time
+from . import bitboard, engine
+
+# (name, FEN, reference node counts for depth 1, 2, 3...), the standard
+# positions from the Chess Programming Wiki perft results page
+POSITIONS = [
+    ("Start position", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609]),
+    ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("En passant", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("Promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("Promotions and castling", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+]
+
+BACKENDS = {"list": engine.GameState, "bitboard": bitboard.BitboardGameState}
+
+
+# Number of leaf nodes of the legal move tree, depth plies deep
+def perft(game_state, depth):
+    if depth == 0:
+        return 1
+    moves = game_state.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        game_state.make_move(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undo_move()
+    return nodes
+
+
+# Perft split by root move, for narrowing down which move a wrong count comes from
+def divide(game_state, depth):
+    counts = {}
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        counts[move.get_chess_notation] = perft(game_state, depth - 1)
+        game_state.undo_move()
+    return counts
+
+
+# Runs every position up to max_depth on a backend, printing node counts,
+# reference counts and nodes/second. Returns False if any count was wrong
+def run_suite(max_depth, game_state_class=engine.GameState):
+    all_passed = True
+    total_nodes = 0
+    total_time = 0
+    for name, fen, expected_counts in POSITIONS:
+        for depth in range(1, min(max_depth, len(expected_counts)) + 1):
+            game_state = game_state_class.from_fen(fen)
+            start_time = time.perf_counter()
+            nodes = perft(game_state, depth)
+            elapsed = time.perf_counter() - start_time
+            total_nodes += nodes
+            total_time += elapsed
+
+            passed = nodes == expected_counts[depth - 1]
+            all_passed = all_passed and passed
+            print("{:<25} depth {}  {:>9} nodes  expected {:>9}  {:<4}  {:>7.2f}s  {:>8.0f} nps".format(
+                name, depth, nodes, expected_counts[depth - 1], "ok" if passed else "FAIL",
+                elapsed, nodes / elapsed if elapsed else 0))
+    print("Total: {} nodes in {:.2f}s, {:.0f} nps".format(
+        total_nodes, total_time, total_nodes / total_time if total_time else 0))
+    return all_passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move generator perft tests and benchmark")
+    parser.add_argument("depth", type=int, nargs="?", default=3)
+    parser.add_argument("--backend", choices=list(BACKENDS) + ["all"], default="all")
+    parser.add_argument("--divide", metavar="FEN",
+                        help="print per-move counts for one position instead")
+    arguments = parser.parse_args()
+
+    backends = list(BACKENDS) if arguments.backend == "all" else [arguments.backend]
+    if arguments.divide:
+        for backend in backends:
+            game_state = BACKENDS[backend].from_fen(arguments.divide)
+            counts = divide(game_state, arguments.depth)
+            for notation in sorted(counts):
+                print("{}: {}".format(notation, counts[notation]))
+            print("Total ({}): {}".format(backend, sum(counts.values())))
+        return
+
+    all_passed = True
+    for backend in backends:
+        print("Backend:", backend)
+        all_passed = run_suite(arguments.depth, BACKENDS[backend]) and all_passed
+    raise SystemExit(0 if all_passed else 1)
+
+
+if __name__ == "__main__":
+    main()
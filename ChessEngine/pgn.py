@@ -0,0 +1,252 @@
+import re
+from . import engine
+
+# The tags every PGN game should have, in the order they are written
+SEVEN_TAG_ROSTER = ["Event", "Site", "Date", "Round", "White", "Black", "Result"]
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+LINE_LENGTH = 80
+
+HEADER_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# Comments, variations, numeric annotations, move numbers and results are
+# matched too so the tokenizer can step over them
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s{}();$]+')
+# Only a number followed by dots, "0-0" and "0-0-0" start with a digit too
+MOVE_NUMBER_PATTERN = re.compile(r'\d+\.+$')
+
+SLIDING_RAYS = {"R": engine.ROOK_RAYS, "B": engine.BISHOP_RAYS, "Q": engine.QUEEN_RAYS}
+
+
+# Standard algebraic notation of a move in the position it is played from,
+# e.g. "Nbd7", "exd6", "e8=Q+", "O-O#". valid_moves can be passed in when
+# they are already known
+def move_to_san(game_state, move, valid_moves=None):
+    if move.is_castling_move:
+        san = "O-O" if move.end_column == 6 else "O-O-O"
+    else:
+        piece = move.piece_moved[1]
+        end_square = move.get_rank_file(move.end_row, move.end_column)
+        capture = "x" if move.piece_captured != "__" else ""
+        if piece == "P":
+            san = (move.columns_to_files[move.start_column] + capture if capture else "") + end_square
+            if move.is_pawn_promotion:
+                san += "=" + move.promotion_piece
+        else:
+            if valid_moves is None:
+                valid_moves = game_state.get_valid_moves()
+            san = piece + disambiguation(move, valid_moves) + capture + end_square
+
+    game_state.make_move(move)
+    if game_state.in_check():
+        san += "#" if not game_state.get_valid_moves() else "+"
+    game_state.undo_move()
+    return san
+
+
+# File, rank or both of the start square, when other pieces of the same kind
+# could also move to the end square
+def disambiguation(move, valid_moves):
+    others = [other for other in valid_moves
+              if other.piece_moved == move.piece_moved and
+              other.end_row == move.end_row and other.end_column == move.end_column and
+              (other.start_row, other.start_column) != (move.start_row, move.start_column)]
+    if not others:
+        return ""
+    if all(other.start_column != move.start_column for other in others):
+        return move.columns_to_files[move.start_column]
+    if all(other.start_row != move.start_row for other in others):
+        return move.rows_to_ranks[move.start_row]
+    return move.get_rank_file(move.start_row, move.start_column)
+
+
+# The legal Move a SAN string stands for in the current position. Instead of
+# generating every legal move, only the legal moves of the pieces that could
+# reach the end square are generated. Raises ValueError if no legal move
+# matches, or more than one does
+def san_to_move(game_state, san):
+    text = san.rstrip("+#!?")
+    color = "w" if game_state.is_white_move else "b"
+    row = 7 if game_state.is_white_move else 0
+
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        end_column = 6 if len(text) == 3 else 2
+        for move in game_state.get_piece_moves(row, 4):
+            if move.is_castling_move and move.end_column == end_column:
+                return move
+        raise ValueError("Cannot castle: " + san)
+
+    promotion_piece = "Q"
+    match = re.match(r"^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$", text)
+    if not match:
+        raise ValueError("Not a SAN move: " + san)
+    piece, from_file, from_rank, capture, end_square, promotion = match.groups()
+    piece = piece or "P"
+    if promotion:
+        promotion_piece = promotion
+    end = (engine.Move.ranks_to_rows[end_square[1]], engine.Move.files_to_columns[end_square[0]])
+
+    candidates = [start for start in reaching_squares(game_state, color + piece, end, capture)
+                  if (from_file is None or start[1] == engine.Move.files_to_columns[from_file]) and
+                  (from_rank is None or start[0] == engine.Move.ranks_to_rows[from_rank])]
+    # Pins, checks and the king stepping into an attack rule candidates out here
+    moves = [move for start in candidates for move in game_state.get_piece_moves(*start)
+             if move.end_row == end[0] and move.end_column == end[1] and
+             not move.is_castling_move and
+             (not move.is_pawn_promotion or move.promotion_piece == promotion_piece)]
+    if not moves:
+        raise ValueError("Illegal move: " + san)
+    if len(moves) > 1:
+        raise ValueError("No unique move for " + san)
+    return moves[0]
+
+
+# Squares holding the given piece that could move to end going by how the
+# piece moves and what is in the way, without looking at checks
+def reaching_squares(game_state, piece, end, capture):
+    board = game_state.board
+    end_row, end_column = end
+    squares = []
+    if piece[1] == "P":
+        # Looking backwards from the end square
+        step = 1 if piece[0] == "w" else -1
+        if capture:
+            for column in (end_column - 1, end_column + 1):
+                if 0 <= column < 8 and 0 <= end_row + step < 8 and \
+                        board[end_row + step][column] == piece:
+                    squares.append((end_row + step, column))
+        elif 0 <= end_row + step < 8:
+            if board[end_row + step][end_column] == piece:
+                squares.append((end_row + step, end_column))
+            elif board[end_row + step][end_column] == "__" and \
+                    end_row + 2 * step == (6 if piece[0] == "w" else 1) and \
+                    board[end_row + 2 * step][end_column] == piece:
+                squares.append((end_row + 2 * step, end_column))
+    elif piece[1] in ("N", "K"):
+        targets = engine.KNIGHT_TARGETS if piece[1] == "N" else engine.KING_TARGETS
+        for row, column in targets[end_row][end_column]:
+            if board[row][column] == piece:
+                squares.append((row, column))
+    else:
+        rays = engine.RAYS[end_row][end_column]
+        for j in SLIDING_RAYS[piece[1]]:
+            for row, column in rays[j]:
+                if board[row][column] != "__":
+                    if board[row][column] == piece:
+                        squares.append((row, column))
+                    break
+    return squares
+
+
+# Reads games one at a time, so files of any size can be read. Yields
+# (headers, san_moves) with headers a dictionary of the tag pairs and
+# san_moves the main line, comments, variations and annotations left out
+def read_games(pgn_file):
+    headers = {}
+    movetext = []
+    in_comment = False
+    for line in pgn_file:
+        stripped = line.strip()
+        if not in_comment and stripped.startswith("["):
+            # A tag after the moves starts the next game
+            if movetext:
+                yield headers, parse_movetext("\n".join(movetext))
+                headers, movetext = {}, []
+            match = HEADER_PATTERN.match(stripped)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+        elif stripped and not stripped.startswith("%"):
+            movetext.append(line.rstrip("\n"))
+            in_comment = ends_in_comment(stripped, in_comment)
+    if headers or movetext:
+        yield headers, parse_movetext("\n".join(movetext))
+
+
+# Whether a brace comment is still open at the end of the line. Braces do not
+# nest and a ; comment runs to the end of the line
+def ends_in_comment(line, in_comment):
+    for character in line:
+        if in_comment:
+            in_comment = character != "}"
+        elif character == "{":
+            in_comment = True
+        elif character == ";":
+            break
+    return in_comment
+
+
+def parse_movetext(movetext):
+    moves = []
+    variation_depth = 0
+    for token in TOKEN_PATTERN.findall(movetext):
+        if token == "(":
+            variation_depth += 1
+        elif token == ")":
+            variation_depth -= 1
+        elif variation_depth == 0 and token[0] not in "{;$" and \
+                not MOVE_NUMBER_PATTERN.match(token) and token not in RESULTS:
+            moves.append(token)
+    return moves
+
+
+# A game state of the game after its moves were played, starting from its
+# FEN tag if it has one
+def replay_game(headers, san_moves, game_state_class=engine.GameState):
+    if "FEN" in headers:
+        game_state = game_state_class.from_fen(headers["FEN"])
+    else:
+        game_state = game_state_class()
+    for san in san_moves:
+        game_state.make_move(san_to_move(game_state, san))
+    return game_state
+
+
+# Writes the game in game_state.move_log as PGN. The moves are taken back to
+# find the start position and then played again, so game_state ends up as it
+# was
+def write_game(pgn_file, game_state, headers=None):
+    moves = list(game_state.move_log)
+    for move in moves:
+        game_state.undo_move()
+    start_fen = game_state.get_fen()
+    start_is_white_move = game_state.is_white_move
+    start_fullmove_number = game_state.fullmove_number
+
+    san_moves = []
+    for move in moves:
+        san_moves.append(move_to_san(game_state, move))
+        game_state.make_move(move)
+    valid_moves = game_state.get_valid_moves()
+    if game_state.check_mate:
+        result = "0-1" if game_state.is_white_move else "1-0"
+    elif not valid_moves:
+        result = "1/2-1/2"
+    else:
+        result = "*"
+
+    tags = {tag: "?" for tag in SEVEN_TAG_ROSTER}
+    tags["Result"] = result
+    if start_fen != engine.START_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = start_fen
+    tags.update(headers or {})
+    for tag, value in tags.items():
+        pgn_file.write('[{} "{}"]\n'.format(tag, value.replace("\\", "\\\\").replace('"', '\\"')))
+    pgn_file.write("\n")
+
+    tokens = []
+    for i, san in enumerate(san_moves):
+        move_number = start_fullmove_number + (i + (0 if start_is_white_move else 1)) // 2
+        if (i % 2 == 0) == start_is_white_move:
+            tokens.append("{}.".format(move_number))
+        elif i == 0:
+            tokens.append("{}...".format(move_number))
+        tokens.append(san)
+    tokens.append(tags["Result"])
+
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            pgn_file.write(line + "\n")
+            line = token
+        else:
+            line = line + " " + token if line else token
+    pgn_file.write(line + "\n\n")
@@ -0,0 +1,88 @@
+import collections
+import re
+
+CACHE_SIZE = 1 << 16
+
+
+def count_pieces(board):
+    return sum(1 for row in board for piece in row if piece != "__")
+
+
+# Syzygy WDL/DTZ tables from a directory, probed with GameStates. Win/draw/loss
+# results are cached by Zobrist key, since search keeps coming back to the
+# same positions
+class Tablebase():
+    def __init__(self, directory, cache_size=CACHE_SIZE):
+        # Reading Syzygy files is left to python-chess, which memory maps them
+        # read only. It is optional and slow to import, so it is only imported
+        # once a tablebase is actually opened
+        try:
+            import chess
+            import chess.syzygy
+        except ImportError:
+            raise ImportError("python-chess is needed to read Syzygy tablebases")
+        self.board_class = chess.Board
+        self.tablebase = chess.syzygy.open_tablebase(directory)
+        # Table names such as "KQvKR" give the most pieces any table covers
+        self.max_pieces = max((len(re.sub("v", "", name)) for name in self.tablebase.wdl),
+                              default=0)
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+
+    def close(self):
+        self.tablebase.close()
+
+    def covers(self, game_state):
+        return count_pieces(game_state.board) <= self.max_pieces
+
+    # 2 for a win of the side to move, 1 for a win that the fifty move rule
+    # turns into a draw, 0 for a draw, -1 and -2 for the losses. None when the
+    # position has no table (or still has castling rights)
+    def probe_wdl(self, game_state):
+        key = game_state.zobrist_key
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        try:
+            wdl = self.tablebase.probe_wdl(self.board_class(game_state.get_fen()))
+        except (KeyError, ValueError):
+            wdl = None
+        self.cache[key] = wdl
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return wdl
+
+    def probe_dtz(self, game_state):
+        try:
+            return self.tablebase.probe_dtz(self.board_class(game_state.get_fen()))
+        except (KeyError, ValueError):
+            return None
+
+    # The move keeping the best result for the side to move and getting there
+    # soonest (or holding out longest when lost), going by the distance to
+    # the next capture or pawn move. Returns (move, wdl), or (None, None) when
+    # a position after some move has no table
+    def probe_root(self, game_state, valid_moves):
+        best_move, best_key, best_wdl = None, None, None
+        for move in valid_moves:
+            game_state.make_move(move)
+            if not game_state.get_valid_moves() and game_state.check_mate:
+                game_state.undo_move()
+                return move, 2
+            wdl = self.probe_wdl(game_state)
+            dtz = self.probe_dtz(game_state)
+            game_state.undo_move()
+            if wdl is None or dtz is None:
+                return None, None
+            # Both are from the opponent's point of view after the move
+            wdl = -wdl
+            zeroing = move.piece_captured != "__" or move.piece_moved[1] == "P"
+            if wdl > 0:
+                key = (wdl, zeroing, dtz)
+            elif wdl < 0:
+                key = (wdl, not zeroing, dtz)
+            else:
+                key = (wdl, 0, 0)
+            if best_key is None or key > best_key:
+                best_move, best_key, best_wdl = move, key, wdl
+        return best_move, best_wdl
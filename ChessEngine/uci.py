@@ -0,0 +1,225 @@
+import sys
+import threading
+from . import AI, bitboard, book, engine, tablebase
+
+ENGINE_NAME = "AI-Chess-Engine"
+ENGINE_AUTHOR = "theIsmail01"
+
+BACKENDS = {"list": engine.GameState, "bitboard": bitboard.BitboardGameState}
+
+# Used for "go" without a depth, the search then runs until it is stopped or
+# runs out of time
+INFINITE_DEPTH = AI.MAX_PLY
+# Moves assumed to be left in the game when the GUI does not say
+MOVES_TO_GO = 30
+# Kept back from the clock for the time it takes to send the move
+MOVE_OVERHEAD_MS = 50
+
+
+# Universal Chess Interface over stdin/stdout, so the engine can be run by
+# chess GUIs and match runners without pygame or a display
+class UCIEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.game_state_class = engine.GameState
+        self.game_state = self.game_state_class()
+        self.searcher = AI.Searcher()
+        self.searcher.on_depth = self.send_info
+        self.own_book = False
+        self.book_file = None
+        self.search_thread = None
+        # With "go infinite" bestmove is held back until "stop" or "quit"
+        self.infinite = False
+        self.stop_received = threading.Event()
+
+    def send(self, line):
+        self.output.write(line + "\n")
+        self.output.flush()
+
+    # Handles one line of input, returns False once the GUI sends "quit"
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default {} min 1 max 1024".format(
+                AI.TABLE_SIZE_MB))
+            self.send("option name Backend type combo default list var list var bitboard")
+            self.send("option name OwnBook type check default false")
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name SyzygyPath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.wait_for_search()
+            self.set_option(tokens[1:])
+        elif command == "ucinewgame":
+            self.wait_for_search()
+            self.searcher.clear()
+            self.game_state = self.game_state_class()
+        elif command == "position":
+            self.wait_for_search()
+            self.set_position(tokens[1:])
+        elif command == "go":
+            self.wait_for_search()
+            self.go(tokens[1:])
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            return False
+        return True
+
+    # setoption name <name> value <value>. Values that do not parse are
+    # ignored, as the protocol expects of bad input
+    def set_option(self, tokens):
+        if "value" not in tokens:
+            return
+        name = " ".join(tokens[1:tokens.index("value")]).lower()
+        value = " ".join(tokens[tokens.index("value") + 1:])
+        if name == "hash":
+            try:
+                size_mb = int(value)
+            except ValueError:
+                return
+            self.searcher.transposition_table = AI.TranspositionTable(size_mb)
+        elif name == "backend" and value in BACKENDS:
+            self.game_state_class = BACKENDS[value]
+            self.game_state = self.game_state_class.from_fen(self.game_state.get_fen())
+        elif name == "ownbook":
+            self.own_book = value == "true"
+        elif name == "bookfile":
+            self.book_file = None if value in ("", "<empty>") else value
+        elif name == "syzygypath":
+            if self.searcher.tablebase is not None:
+                self.searcher.tablebase.close()
+                self.searcher.tablebase = None
+            if value not in ("", "<empty>"):
+                try:
+                    self.searcher.tablebase = tablebase.Tablebase(value)
+                except (ImportError, OSError) as error:
+                    self.send("info string cannot open tablebase: " + str(error))
+        if name in ("ownbook", "bookfile"):
+            if self.searcher.book is not None:
+                self.searcher.book.close()
+                self.searcher.book = None
+            if self.own_book and self.book_file:
+                try:
+                    self.searcher.book = book.OpeningBook(self.book_file)
+                except OSError as error:
+                    self.send("info string cannot open book: " + str(error))
+
+    # position [startpos | fen <fen>] [moves <move1> ... <movei>]
+    def set_position(self, tokens):
+        moves = []
+        if "moves" in tokens:
+            moves = tokens[tokens.index("moves") + 1:]
+            tokens = tokens[:tokens.index("moves")]
+        if tokens and tokens[0] == "fen":
+            self.game_state = self.game_state_class.from_fen(" ".join(tokens[1:]))
+        else:
+            self.game_state = self.game_state_class()
+        for notation in moves:
+            move = self.find_move(notation)
+            if move is None:
+                self.send("info string illegal move " + notation)
+                return
+            self.game_state.make_move(move)
+
+    def find_move(self, notation):
+        for move in self.game_state.get_valid_moves():
+            if move.get_chess_notation == notation:
+                return move
+        return None
+
+    # go [depth <x>] [movetime <x>] [wtime <x>] [btime <x>] [winc <x>]
+    #    [binc <x>] [movestogo <x>] [nodes <x>] [infinite]. A limit whose
+    #    value is not a number is ignored
+    def go(self, tokens):
+        limits = {}
+        for i in range(len(tokens) - 1):
+            if tokens[i] in ("depth", "movetime", "wtime", "btime", "winc",
+                             "binc", "movestogo", "nodes"):
+                try:
+                    limits[tokens[i]] = int(tokens[i + 1])
+                except ValueError:
+                    pass
+        self.infinite = "infinite" in tokens
+        self.stop_received.clear()
+
+        self.searcher.max_depth = limits.get("depth", INFINITE_DEPTH)
+        self.searcher.node_limit = limits.get("nodes")
+        self.searcher.time_limit_ms = self.time_budget(limits)
+
+        valid_moves = self.game_state.get_valid_moves()
+        self.search_thread = threading.Thread(target=self.search,
+                                              args=(valid_moves,))
+        self.search_thread.start()
+
+    # A fixed movetime is used as it is. Otherwise the remaining clock is
+    # shared out over the moves still to play, plus most of the increment
+    def time_budget(self, limits):
+        if "movetime" in limits:
+            return max(1, limits["movetime"] - MOVE_OVERHEAD_MS)
+        if self.game_state.is_white_move:
+            time_left, increment = limits.get("wtime"), limits.get("winc", 0)
+        else:
+            time_left, increment = limits.get("btime"), limits.get("binc", 0)
+        if time_left is None:
+            return None
+        budget = time_left // limits.get("movestogo", MOVES_TO_GO) + increment * 3 // 4
+        return max(1, min(budget, time_left - MOVE_OVERHEAD_MS))
+
+    def search(self, valid_moves):
+        notation = "0000"
+        if valid_moves:
+            move = self.searcher.search(self.game_state, valid_moves)
+            notation = move.get_chess_notation
+        if self.infinite:
+            self.stop_received.wait()
+        self.send("bestmove " + notation)
+
+    def send_info(self, searcher):
+        principal_variation = searcher.principal_variation(self.game_state)
+        score_type, score = AI.reported_score(
+            searcher.best_score, self.game_state.is_white_move, principal_variation)
+        milliseconds = int(searcher.elapsed * 1000)
+        self.send("info depth {} score {} {} nodes {} nps {} time {} pv {}".format(
+            searcher.depth_reached, score_type, score, searcher.nodes,
+            int(searcher.nodes / searcher.elapsed) if searcher.elapsed else 0,
+            milliseconds, " ".join(move.get_chess_notation for move in principal_variation)))
+
+    def stop(self):
+        if self.search_thread is not None and self.search_thread.is_alive():
+            self.searcher.stop()
+        self.stop_received.set()
+        self.wait_for_search()
+        # In case the search finished on its own before seeing the request
+        self.searcher.stop_requested = False
+
+    def wait_for_search(self):
+        if self.search_thread is not None:
+            # An infinite search would never end, a command that has to wait
+            # for it stops it instead
+            if self.infinite:
+                self.searcher.stop()
+                self.stop_received.set()
+            self.search_thread.join()
+            self.search_thread = None
+            self.searcher.stop_requested = False
+
+
+def main():
+    uci_engine = UCIEngine()
+    for line in sys.stdin:
+        if not uci_engine.handle(line):
+            break
+    uci_engine.stop()
+
+
+if __name__ == "__main__":
+    main()
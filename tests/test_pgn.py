@@ -0,0 +1,85 @@
+import io
+import random
+
+import pytest
+
+from ChessEngine import bitboard, engine, pgn
+
+chess = pytest.importorskip("chess")
+chess_pgn = pytest.importorskip("chess.pgn")
+
+GAMES = 40
+MAX_PLIES = 200
+BACKENDS = [engine.GameState, bitboard.BitboardGameState]
+
+
+# Random games played side by side with python-chess, which gives the
+# reference SAN and positions. Yields (board, game_state, chess_move, move)
+# before every move, the move is pushed on board afterwards but has to be
+# made on game_state by the caller
+def random_game_moves(game_state_class, seed):
+    rng = random.Random(seed)
+    board = chess.Board()
+    game_state = game_state_class()
+    for ply in range(MAX_PLIES):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        chess_move = rng.choice(legal_moves)
+        moves = {move.get_chess_notation: move for move in game_state.get_valid_moves()}
+        yield board, game_state, chess_move, moves[chess_move.uci()]
+        board.push(chess_move)
+
+
+@pytest.mark.parametrize("game_state_class", BACKENDS)
+def test_san_matches_python_chess(game_state_class):
+    for seed in range(GAMES):
+        for board, game_state, chess_move, move in random_game_moves(game_state_class, seed):
+            san = board.san(chess_move)
+            assert pgn.move_to_san(game_state, move) == san, board.fen()
+            parsed = pgn.san_to_move(game_state, san)
+            assert parsed.move_id == move.move_id, (board.fen(), san)
+            assert parsed.is_enpassant_move == move.is_enpassant_move
+            assert parsed.is_castling_move == move.is_castling_move
+            game_state.make_move(parsed)
+
+
+@pytest.mark.parametrize("game_state_class", BACKENDS)
+def test_written_games_read_back(game_state_class):
+    texts = []
+    end_fens = []
+    for seed in range(GAMES):
+        for board, game_state, chess_move, move in random_game_moves(game_state_class, seed):
+            game_state.make_move(move)
+        text = io.StringIO()
+        pgn.write_game(text, game_state, {"Event": 'Game "{}"'.format(seed)})
+        # python-chess reads what was written the same way
+        written_game = chess_pgn.read_game(io.StringIO(text.getvalue()))
+        assert written_game.end().board().fen() == board.fen()
+        texts.append(text.getvalue())
+        end_fens.append(board.fen())
+
+    games = list(pgn.read_games(io.StringIO("".join(texts))))
+    assert len(games) == GAMES
+    for seed, (headers, san_moves) in enumerate(games):
+        assert headers["Event"] == 'Game "{}"'.format(seed)
+        game_state = pgn.replay_game(headers, san_moves, game_state_class)
+        assert game_state.get_fen() == end_fens[seed]
+
+
+def test_read_games_skips_comments_variations_and_move_numbers():
+    text = '[Event "?"]\n\n1. e4 {a\nmulti-line comment} e5 $1 (1... c5 2. Nf3) 2. Nf3 ; rest\n' \
+           'Nc6 3. Bc4 Bc5 4. 0-0 Nf6 5.O-O-O 1-0\n'
+    [(headers, san_moves)] = list(pgn.read_games(io.StringIO(text)))
+    assert headers == {"Event": "?"}
+    assert san_moves == ["e4", "e5", "Nf3", "Nc6", "Bc4", "Bc5", "0-0", "Nf6", "O-O-O"]
+
+
+def test_zero_castling_replays():
+    text = "1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. 0-0 Nf6 *\n"
+    [(headers, san_moves)] = list(pgn.read_games(io.StringIO(text)))
+    game_state = pgn.replay_game(headers, san_moves)
+    board = chess.Board()
+    for san in san_moves:
+        board.push_san(san.replace("0", "O"))
+    assert game_state.get_fen() == board.fen()